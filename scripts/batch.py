@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import csv
+import glob
+import importlib
+import io
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from commented_csv import CommentedReader
+from path_parameters import DEFAULT_PATTERN, parameters
+
+Rows = Tuple[List[str], List[List[str]]]
+
+
+def log(*args: Any) -> None:
+    print("{}:".format(sys.argv[0]), *args, file=sys.stderr)
+
+
+def output_to(path: Optional[str]) -> Any:
+    return sys.stdout if not path else open(path, "w")
+
+
+def parse_csv(text: str) -> Rows:
+    reader = CommentedReader(io.StringIO(text))
+    if reader.fieldnames is None:
+        return [], []
+    return reader.fieldnames, list(reader)
+
+
+def parse_padded(text: str, padding: int = 15) -> Rows:
+    header, row = [], []
+    for line in text.splitlines():
+        if line.strip():
+            header.append(line[:padding].strip().lower().replace(" ", "_"))
+            row.append(line[padding:].strip())
+    return header, [row]
+
+
+def parse_pairs(text: str) -> Rows:
+    header, row = [], []
+    for line in text.splitlines():
+        if line.strip():
+            key, value = line.split(None, 1)
+            header.append(key)
+            row.append(value.strip())
+    return header, [row]
+
+
+def parse_value(name: str) -> Callable[[str], Rows]:
+    return lambda text: ([name], [[x] for x in text.splitlines() if x.strip()])
+
+
+OPERATIONS: Dict[str, Tuple[Callable[[str], Rows], str]] = {
+    "count_samples": (parse_csv, ".json"),
+    "count_executions": (parse_csv, ".json"),
+    "csv_column_operation2": (parse_csv, ".csv"),
+    "csv_compact_dataset": (parse_csv, ".csv"),
+    "csv_field_stats": (parse_padded, ".csv"),
+    "csv_remove_first_row": (parse_csv, ".csv"),
+    "extract_time": (parse_value("time"), ".csv"),
+    "file_stats_of_lines": (parse_pairs, ""),
+    "ground_truth_sensors_extract": (parse_csv, ".probe"),
+    "perf_convert_output": (parse_csv, ".csv"),
+    "perf_convert_to_power": (parse_csv, ".csv"),
+    "perf_filter_duplicates": (parse_csv, ".csv"),
+    "relative_time": (parse_csv, ".csv"),
+}
+
+
+class _Capture(io.StringIO):
+    # scripts close their output when done, keep the buffer readable
+    def close(self) -> None:
+        pass
+
+
+def run_operation(operation: str, path: str, argv: Sequence[str]) -> Rows:
+    module = importlib.import_module(operation)
+    saved_argv = sys.argv
+    out = _Capture()
+    sys.argv = [module.__file__] + list(argv) + [path]
+    try:
+        with contextlib.redirect_stdout(out):
+            module.main()
+    except SystemExit as err:
+        if err.code:
+            raise AssertionError("exited with status {}".format(err.code))
+    finally:
+        sys.argv = saved_argv
+    return OPERATIONS[operation][0](out.getvalue())
+
+
+def _run_task(task: Tuple[str, str, Sequence[str]]) -> Tuple[str, Optional[Rows], str]:
+    operation, path, argv = task
+    try:
+        return path, run_operation(operation, path, argv), ""
+    except Exception as err:
+        return path, None, "{}: {}".format(type(err).__name__, err)
+
+
+def expand_sources(sources: Sequence[str], suffix: str) -> List[str]:
+    files = set()
+    for src in sources:
+        if os.path.isdir(src):
+            for root, _, names in os.walk(src):
+                files.update(os.path.join(root, n) for n in names if n.endswith(suffix))
+        else:
+            files.update(p for p in glob.glob(src, recursive=True) if os.path.isfile(p))
+    return sorted(files)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument(
+        "operation",
+        action="store",
+        help="script to run on each file",
+        choices=sorted(OPERATIONS),
+        type=str,
+    )
+    parser.add_argument(
+        "sources",
+        action="store",
+        help="files, directories or glob patterns to process",
+        nargs="+",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        help="output file (default: stdout)",
+        required=False,
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        help="number of worker processes (default: CPU count)",
+        required=False,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-a",
+        "--args",
+        action="store",
+        help="arguments forwarded to the operation (default: none)",
+        required=False,
+        type=shlex.split,
+        default=[],
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        action="store",
+        help="regular expression whose named groups become parameter columns",
+        required=False,
+        type=re.compile,
+        default=re.compile(DEFAULT_PATTERN),
+    )
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a script over many files in parallel and merge the results"
+    )
+    args = add_arguments(parser).parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be >= 1")
+    files = expand_sources(args.sources, OPERATIONS[args.operation][1])
+    if not files:
+        raise AssertionError("No files to process")
+
+    tasks = [(args.operation, f, args.args) for f in files]
+    results = []
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        # map keeps input order, so the merged output does not depend on timing
+        chunksize = max(1, len(tasks) // (4 * (args.jobs or os.cpu_count() or 1)))
+        for path, rows, error in executor.map(_run_task, tasks, chunksize=chunksize):
+            if rows is None:
+                failed += 1
+                log("failed to process", path, "-", error)
+            else:
+                results.append((path, parameters(path, args.pattern), rows))
+
+    param_names = [
+        n for n in args.pattern.groupindex if any(n in p for _, p, _ in results)
+    ]
+    fieldnames = ["file"] + param_names
+    for _, _, (header, _) in results:
+        fieldnames.extend(h for h in header if h not in fieldnames)
+    with output_to(args.output) as of:
+        writer = csv.DictWriter(of, fieldnames, restval="")
+        writer.writeheader()
+        for path, params, (header, rows) in results:
+            for row in rows:
+                out = dict(zip(header, row))
+                out["file"] = path
+                out.update(params)
+                writer.writerow(out)
+    if failed:
+        log(failed, "of", len(tasks), "files failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Clock offset and drift between two power signals, by cross-correlation.
+
+Both signals are given as cumulative energy (J) at their own sample times
+(ns) and resampled to average power over bins of a common width, so a 1 Hz
+meter and a 20 Hz profiler compare on equal footing. The second signal's
+power, zero outside the spans it covers, is a matched filter for the
+first: the lag maximising their FFT cross-correlation gives the offset,
+refined to a fraction of a bin with a parabola through the peak.
+
+Drift is found the same way over a grid of candidate rates: the second
+timeline is stretched by each, the one correlating best (Pearson's r over
+the covered bins) wins and a parabola through its neighbours refines it.
+Short runs only resolve large drifts.
+
+The fitted clock maps times t of the first signal to the second as
+t + offset + drift * (t - origin).
+"""
+
+import math
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+Span = Tuple[int, int]
+
+
+class ClockFit(NamedTuple):
+    origin_ns: int
+    offset_ns: float
+    drift_ppm: float
+    correlation: float
+
+    def apply(self, times: np.ndarray) -> np.ndarray:
+        # epoch nanoseconds lose precision as float64, only the drift term is
+        # computed in floating point
+        drift = self.drift_ppm * 1e-6
+        skew = np.rint(drift * (times - self.origin_ns)).astype(np.int64)
+        return times + int(round(self.offset_ns)) + skew
+
+
+def bin_power(
+    times: np.ndarray, energy: np.ndarray, start: float, step: float, bins: int
+) -> np.ndarray:
+    # average power of each bin from the cumulative energy at its edges
+    edges = start + step * np.arange(bins + 1)
+    return np.diff(np.interp(edges, times, energy)) / (step * 1e-9)
+
+
+def covered(spans: Sequence[Span], start: float, step: float, bins: int) -> np.ndarray:
+    # bins lying entirely inside one of SPANS, e.g. the profiled executions
+    edges = start + step * np.arange(bins + 1)
+    mask = np.zeros(bins, dtype=bool)
+    for first, last in spans:
+        mask |= (edges[:-1] >= first) & (edges[1:] <= last)
+    return mask
+
+
+def cross_correlation(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # c[k] = sum(a[i + k] * b[i]) for k from -(len(b) - 1) to len(a) - 1
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    r = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+    return np.concatenate((r[size - (len(b) - 1) :], r[: len(a)]))
+
+
+def peak_lag(a: np.ndarray, b: np.ndarray, lo: int, hi: int) -> Tuple[float, float]:
+    # lag within [LO, HI] of the highest correlation, and that correlation
+    c = cross_correlation(a, b)
+    zero = len(b) - 1
+    lo, hi = max(lo, -zero), min(hi, len(a) - 1)
+    if lo > hi:
+        raise AssertionError("Signals do not overlap within the allowed lags")
+    k = lo + int(np.argmax(c[zero + lo : zero + hi + 1]))
+    if lo < k < hi:
+        y0, y1, y2 = c[zero + k - 1 : zero + k + 2]
+        curvature = y0 - 2 * y1 + y2
+        if curvature < 0:
+            return k + 0.5 * (y0 - y2) / curvature, float(y1)
+    return float(k), float(c[zero + k])
+
+
+def _correlation(a: np.ndarray, b: np.ndarray, mask: np.ndarray, lag: float) -> float:
+    # Pearson's r of the overlapping bins
+    k = int(round(lag))
+    first = max(0, -k)
+    last = min(len(b), len(a) - k)
+    keep = mask[first:last]
+    if keep.sum() < 2:
+        return math.nan
+    x, y = a[first + k : last + k][keep], b[first:last][keep]
+    x, y = x - x.mean(), y - y.mean()
+    denom = math.sqrt(float(np.dot(x, x) * np.dot(y, y)))
+    return float(np.dot(x, y)) / denom if denom else math.nan
+
+
+def match(
+    reference: Tuple[np.ndarray, np.ndarray],
+    signal: Tuple[np.ndarray, np.ndarray],
+    step: float,
+    spans: Optional[Sequence[Span]],
+    guess: Optional[float],
+    max_lag: Optional[float],
+) -> Tuple[float, float, float]:
+    # offset from REFERENCE's clock to SIGNAL's, the normalised peak and the
+    # correlation at that offset
+    start = signal[0][0]
+    bins = int((signal[0][-1] - start) // step)
+    if bins < 3:
+        raise AssertionError("Signal is shorter than 3 bins")
+    b = bin_power(*signal, start, step, bins)
+    mask = covered(spans, start, step, bins) if spans else np.ones(bins, bool)
+    b[~mask] = 0.0
+    norm = math.sqrt(float(np.dot(b, b)))
+    if not norm:
+        raise AssertionError("Signal has no power")
+    r_times = reference[0]
+    r_bins = int((r_times[-1] - r_times[0]) // step)
+    if r_bins < 3:
+        raise AssertionError("Reference is shorter than 3 bins")
+    a = bin_power(*reference, r_times[0], step, r_bins)
+    a -= a.mean()
+    # lag k lines a[i + k] up with b[i], so offset = b's start - a's start - k
+    base = start - r_times[0]
+    if max_lag is None:
+        if guess is None:
+            lo, hi = sorted((0, len(a) - len(b)))
+        else:
+            lo, hi = -len(b), len(a)
+    else:
+        expected = guess if guess is not None else 0.0
+        lo = math.ceil((base - expected - max_lag) / step)
+        hi = math.floor((base - expected + max_lag) / step)
+    lag, peak = peak_lag(a, b, lo, hi)
+    return base - lag * step, peak / norm, _correlation(a, b, mask, lag)
+
+
+def stretch(
+    signal: Tuple[np.ndarray, np.ndarray],
+    spans: Optional[Sequence[Span]],
+    drift: float,
+) -> Tuple[Tuple[np.ndarray, np.ndarray], Optional[Sequence[Span]]]:
+    # SIGNAL's times at the reference's rate, for a clock running DRIFT fast
+    times, energy = signal
+    start = times[0]
+    scale = 1 + drift
+    if spans:
+        spans = [
+            (start + (x - start) / scale, start + (y - start) / scale) for x, y in spans
+        ]
+    return (start + (times - start) / scale, energy), spans
+
+
+def fit_clock(
+    reference: Tuple[np.ndarray, np.ndarray],
+    signal: Tuple[np.ndarray, np.ndarray],
+    step: float,
+    spans: Optional[Sequence[Span]] = None,
+    max_lag: Optional[float] = None,
+    guess: Optional[float] = None,
+    max_drift_ppm: float = 0.0,
+    drift_steps: int = 21,
+) -> ClockFit:
+    drifts = [0.0]
+    if max_drift_ppm > 0 and drift_steps > 1:
+        drifts = np.linspace(-max_drift_ppm, max_drift_ppm, drift_steps).tolist()
+    scores = []
+    for ppm in drifts:
+        stretched, stretched_spans = stretch(signal, spans, ppm * 1e-6)
+        scores.append(
+            match(reference, stretched, step, stretched_spans, guess, max_lag)[2]
+        )
+    ix = int(np.argmax(scores))
+    ppm = drifts[ix]
+    if 0 < ix < len(drifts) - 1:
+        y0, y1, y2 = scores[ix - 1 : ix + 2]
+        curvature = y0 - 2 * y1 + y2
+        if curvature < 0:
+            ppm += 0.5 * (y0 - y2) / curvature * (drifts[1] - drifts[0])
+    drift = ppm * 1e-6
+    stretched, stretched_spans = stretch(signal, spans, drift)
+    offset, _, correlation = match(
+        reference, stretched, step, stretched_spans, guess, max_lag
+    )
+    # the stretch is about the signal's start, the fit about the reference's
+    origin = int(reference[0][0])
+    start = signal[0][0]
+    offset += drift * (origin + offset - start)
+    return ClockFit(origin, offset, ppm, correlation)
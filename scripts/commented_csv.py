@@ -0,0 +1,301 @@
+"""CSV files with '#' comment lines, as written and read by the scripts.
+
+Comments before the header are kept as metadata (e.g. the '#units' row);
+comments between data rows are handed to a callback as they are met, so
+callers decide whether to drop them or write them through in place.
+Input is read in large chunks and chunks without any '#' skip the
+per-line comment test entirely.
+
+Numeric columns are typed once from a sample of the first rows
+(ColumnTypes) so each cell is parsed by a single converter, instead of
+trying int() and falling back to float() on every cell.
+"""
+
+import csv
+import re
+from itertools import chain, islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+CHUNK_SIZE = 1 << 16
+SAMPLE_ROWS = 64
+# cells int() accepts, one per line of a joined column
+_INTEGRAL = re.compile(r"^\s*[+-]?\d+\s*$", re.MULTILINE)
+
+CommentHandler = Callable[[str], None]
+Number = Union[int, float]
+
+
+def iter_chunks(f: Any, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    remainder = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind("\n") + 1
+        if not end:
+            remainder += chunk
+            continue
+        yield remainder + chunk[:end]
+        remainder = chunk[end:]
+    if remainder:
+        yield remainder
+
+
+def data_lines(
+    f: Any,
+    comment: Optional[str] = "#",
+    on_comment: Optional[CommentHandler] = None,
+    strip: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[str]:
+    for chunk in iter_chunks(f, chunk_size):
+        lines = chunk.splitlines(True)
+        if comment is None or comment not in chunk:
+            if strip:
+                yield from (s for s in (x.strip() for x in lines) if s)
+            else:
+                yield from (x for x in lines if not x.isspace())
+            continue
+        for line in lines:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith(comment):
+                if on_comment is not None:
+                    on_comment(line)
+            else:
+                yield stripped if strip else line
+
+
+def int_or_float(x: str) -> Number:
+    # int() never accepts a '.', so decimals skip the failing attempt
+    if "." in x:
+        return float(x)
+    try:
+        return int(x)
+    except ValueError:
+        return float(x)
+
+
+def _int(x: str) -> Number:
+    try:
+        return int(x)
+    except ValueError:
+        return float(x)
+
+
+def _identity(x: str) -> str:
+    return x
+
+
+def _kind(values: Iterable[str]) -> Any:
+    kind: Any = int
+    integral = False
+    for x in values:
+        try:
+            int(x)
+            integral = True
+            continue
+        except ValueError:
+            kind = float
+        try:
+            float(x)
+        except ValueError:
+            return str
+    # ints among floats keep their formatting
+    return Number if kind is float and integral else kind
+
+
+class ColumnTypes:
+    """Per-column kind (int, float, Number or str) inferred from sample rows.
+
+    Int columns parse with int() and float columns with float(), a single
+    attempt per cell, so results keep the formatting of their column.
+    Columns whose sample mixes integral and decimal cells (e.g. "3" among
+    "1.5") are Number and parse as int_or_float, so "3" stays an int. Str
+    columns are left as text, numeric() parses them with int_or_float
+    for arithmetic. An int cell that does not fit falls back to float.
+    """
+
+    _CONVERTERS: Dict[Any, Callable[[str], Any]] = {
+        int: _int,
+        float: float,
+        Number: int_or_float,
+        str: _identity,
+    }
+
+    def __init__(self, kinds: Sequence[Any]) -> None:
+        self.kinds = list(kinds)
+        self.converters = [self._CONVERTERS[k] for k in self.kinds]
+
+    @classmethod
+    def infer(cls, rows: Sequence[Sequence[str]], width: int) -> "ColumnTypes":
+        return cls([_kind(r[ix] for r in rows if ix < len(r)) for ix in range(width)])
+
+    def converter(self, ix: int) -> Callable[[str], Any]:
+        return self.converters[ix] if ix < len(self.converters) else int_or_float
+
+    def numeric(self, ix: int) -> Callable[[str], Any]:
+        # for arithmetic: cells of a str column must still parse as numbers
+        converter = self.converter(ix)
+        return int_or_float if converter is _identity else converter
+
+    def convert(self, row: Sequence[str]) -> List[Any]:
+        return [c(x) for c, x in zip(self.converters, row)]
+
+    def array(self, ix: int, values: Sequence[str]) -> Any:
+        import numpy as np
+
+        kind = self.kinds[ix] if ix < len(self.kinds) else str
+        if kind in (int, float) or (
+            kind is Number and not _INTEGRAL.search("\n".join(values))
+        ):
+            try:
+                return np.array(values, dtype=np.int64 if kind is int else np.float64)
+            except (ValueError, OverflowError):
+                pass
+        numbers = [int_or_float(x) for x in values]
+        # ints among floats stay ints, as int_or_float gives them
+        mixed = len(set(map(type, numbers))) > 1
+        return np.array(numbers, dtype=object if mixed else None)
+
+
+def parse_line(line: str, delimiter: str = ",") -> List[str]:
+    return next(csv.reader((line,), delimiter=delimiter), [])
+
+
+class CommentedReader:
+    def __init__(
+        self,
+        f: Any,
+        delimiter: str = ",",
+        comment: Optional[str] = "#",
+        header: bool = True,
+        on_comment: Optional[CommentHandler] = None,
+        strip: bool = False,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.delimiter = delimiter
+        self.meta_lines: List[str] = []
+        self.types: Optional[ColumnTypes] = None
+        # rows read ahead by infer_types, with the comments found between them
+        self._buffer: List[Union[str, List[str]]] = []
+        self._sampling = False
+        self._on_comment = on_comment
+        self._header_read = not header
+        self._rows = csv.reader(
+            data_lines(f, comment, self._comment, strip, chunk_size),
+            delimiter=delimiter,
+        )
+        self._data = (r for r in self._rows if r)
+        self.fieldnames: Optional[List[str]] = None
+        if header:
+            self.fieldnames = next(self._data, None)
+            self._header_read = True
+
+    def _comment(self, line: str) -> None:
+        if not self._header_read or self._on_comment is None:
+            self.meta_lines.append(line)
+        elif self._sampling:
+            self._buffer.append(line)
+        else:
+            self._on_comment(line)
+
+    def _replay(self, buffered: List[Union[str, List[str]]]) -> Iterator[List[str]]:
+        for item in buffered:
+            if isinstance(item, str):
+                self._comment(item)
+            else:
+                yield item
+
+    @property
+    def meta(self) -> List[List[str]]:
+        return [parse_line(x, self.delimiter) for x in self.meta_lines]
+
+    @property
+    def units(self) -> Dict[str, str]:
+        units = {}
+        for row in self.meta:
+            if row and row[0] == "#units":
+                units.update(x.split("=", 1) for x in row[1:] if "=" in x)
+        return units
+
+    @property
+    def line_num(self) -> int:
+        return self._rows.line_num
+
+    def __iter__(self) -> Iterator[List[str]]:
+        buffered, self._buffer = self._buffer, []
+        return chain(self._replay(buffered), self._data)
+
+    def infer_types(self, sample: int = SAMPLE_ROWS) -> ColumnTypes:
+        # sampled rows (and comments between them) are buffered and still
+        # come out, in order, of the next iteration
+        self._sampling = True
+        try:
+            for row in islice(self._data, sample):
+                self._buffer.append(row)
+        finally:
+            self._sampling = False
+        rows = [r for r in self._buffer if not isinstance(r, str)]
+        width = max([len(self.fieldnames or [])] + [len(r) for r in rows])
+        self.types = ColumnTypes.infer(rows, width)
+        return self.types
+
+    def converter(self, field: str) -> Callable[[str], Any]:
+        types = self.types or self.infer_types()
+        return types.numeric(self.index(field))
+
+    def dicts(self) -> Iterator[Dict[Optional[str], Any]]:
+        # same row shape as csv.DictReader with default restkey/restval
+        fieldnames = self.fieldnames or []
+        width = len(fieldnames)
+        for row in self:
+            d = dict(zip(fieldnames, row))
+            if len(row) > width:
+                d[None] = row[width:]
+            elif len(row) < width:
+                for key in fieldnames[len(row) :]:
+                    d[key] = None
+            yield d
+
+    def index(self, field: str) -> int:
+        if self.fieldnames is None or field not in self.fieldnames:
+            raise AssertionError("{} is not a valid fieldname".format(field))
+        return self.fieldnames.index(field)
+
+    def columns(
+        self, fields: Sequence[str], typed: bool = False
+    ) -> Dict[str, List[Any]]:
+        ixs = [self.index(x) for x in fields]
+        cols: List[List[str]] = [[] for _ in ixs]
+        types = (self.types or self.infer_types()) if typed else None
+        for row in self:
+            for col, ix in zip(cols, ixs):
+                col.append(row[ix])
+        if types is None:
+            return dict(zip(fields, cols))
+        return {
+            f: list(map(types.converter(ix), col))
+            for f, ix, col in zip(fields, ixs, cols)
+        }
+
+    def arrays(self, fields: Sequence[str]) -> Dict[str, Any]:
+        types = self.types or self.infer_types()
+        ixs = [self.index(x) for x in fields]
+        cols = self.columns(fields)
+        return {f: types.array(ix, cols[f]) for f, ix in zip(fields, ixs)}
+
+
+def write_meta(writer: Any, meta: Iterable[List[str]]) -> None:
+    writer.writerows(meta)
@@ -2,9 +2,10 @@
 
 import argparse
 import csv
-import json
 import sys
 
+from profiler_reader import iter_section_summaries, load_section_summaries
+
 
 def read_from(path):
     return sys.stdin if not path else open(path, "r")
@@ -13,6 +14,7 @@ def read_from(path):
 def output_to(path):
     return sys.stdout if not path else open(path, "w")
 
+
 def add_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
         "source_file",
@@ -31,20 +33,58 @@ def add_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="read the file incrementally in constant memory, slower than "
+        "parsing it whole (default: off)",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--cache",
+        action="store",
+        help="directory to cache parsed files in; the first read of a file "
+        "takes about 3x longer, later ones skip parsing (default: no cache)",
+        required=False,
+        type=str,
+        default=None,
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--cache-size",
+        action="store",
+        help="cache size budget in MiB (default: 1024)",
+        required=False,
+        type=int,
+        default=1024,
+        metavar="MIB",
+    )
     return parser
 
+
+def section_summaries(args, f):
+    if args.cache and args.source_file:
+        from profiler_cache import ProfileCache
+        from profiler_loader import section_summaries
+
+        cache = ProfileCache(args.cache, args.cache_size << 20)
+        return section_summaries(cache.load(args.source_file))
+    if args.stream:
+        return iter_section_summaries(f)
+    return load_section_summaries(f)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Count executions of each section")
     args = add_args(parser).parse_args()
     with read_from(args.source_file) as f:
-        json_in = json.load(f)
         with output_to(args.output) as o:
             wrt = csv.writer(o)
             wrt.writerow(("group", "section", "executions"))
-            for g in json_in["groups"]:
-                for s in g["sections"]:
-                    wrt.writerow((g["label"], s["label"], len(s["executions"])))
+            for s in section_summaries(args, f):
+                wrt.writerow((s.group, s.section, s.executions))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,9 +2,10 @@
 
 import argparse
 import csv
-import json
 import sys
 
+from profiler_reader import iter_execution_summaries, load_execution_summaries
+
 
 def read_from(path):
     return sys.stdin if not path else open(path, "r")
@@ -13,6 +14,7 @@ def read_from(path):
 def output_to(path):
     return sys.stdout if not path else open(path, "w")
 
+
 def add_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
         "source_file",
@@ -31,22 +33,58 @@ def add_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="read the file incrementally in constant memory, slower than "
+        "parsing it whole (default: off)",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--cache",
+        action="store",
+        help="directory to cache parsed files in; the first read of a file "
+        "takes about 3x longer, later ones skip parsing (default: no cache)",
+        required=False,
+        type=str,
+        default=None,
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--cache-size",
+        action="store",
+        help="cache size budget in MiB (default: 1024)",
+        required=False,
+        type=int,
+        default=1024,
+        metavar="MIB",
+    )
     return parser
 
+
+def execution_summaries(args, f):
+    if args.cache and args.source_file:
+        from profiler_cache import ProfileCache
+        from profiler_loader import execution_summaries
+
+        cache = ProfileCache(args.cache, args.cache_size << 20)
+        return execution_summaries(cache.load(args.source_file))
+    if args.stream:
+        return iter_execution_summaries(f)
+    return load_execution_summaries(f)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Count samples of each execution")
     args = add_args(parser).parse_args()
     with read_from(args.source_file) as f:
-        json_in = json.load(f)
         with output_to(args.output) as o:
             wrt = csv.writer(o)
             wrt.writerow(("group", "section", "execution", "duration", "samples"))
-            for g in json_in["groups"]:
-                for s in g["sections"]:
-                    for idx, e in enumerate(s["executions"], start=1):
-                        duration = e["sample_times"][-1] - e["sample_times"][0]
-                        wrt.writerow((g["label"], s["label"], idx, duration, len(e["sample_times"])))
+            for e in execution_summaries(args, f):
+                wrt.writerow((e.group, e.section, e.execution, e.duration, e.samples))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,7 +4,15 @@ import argparse
 import csv
 import sys
 from itertools import zip_longest
-from typing import Any, Callable, Optional, Tuple, Union
+from typing import Any, Callable, List, Optional, Tuple
+
+from commented_csv import CommentedReader
+
+Table = Tuple[CommentedReader, List[List[str]]]
+
+
+def log(*args: Any) -> None:
+    print("{}:".format(sys.argv[0]), *args, file=sys.stderr)
 
 
 def output_to(path: Optional[str]) -> Any:
@@ -45,16 +53,36 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         choices=("sub", "add", "mul", "div"),
         type=str,
     )
+    parser.add_argument(
+        "-n",
+        "--numpy",
+        action="store_true",
+        help="load the fields as arrays and operate on whole columns (requires numpy)",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "-k",
+        "--key",
+        action="store",
+        help="pair rows by the value of column KEY instead of by position (implies -n)",
+        required=False,
+        type=str,
+        default=None,
+        metavar="KEY",
+    )
+    parser.add_argument(
+        "--match",
+        action="store",
+        help="how KEY values are paired: equal, nearest, or the last right-side "
+        "value not after the left-side one (default: exact)",
+        required=False,
+        choices=("exact", "nearest", "backward"),
+        default="exact",
+    )
     return parser
 
 
-def _int_or_float(x: str) -> Union[int, float]:
-    try:
-        return int(x)
-    except ValueError:
-        return float(x)
-
-
 def _get_operation(x: str) -> Callable:
     lower = x.lower()
     if lower == "sub":
@@ -68,35 +96,128 @@ def _get_operation(x: str) -> Callable:
     raise AssertionError("Invalid operation {}".format(x))
 
 
-def read_file(f) -> Tuple[csv.reader, csv.reader]:
-    comments = []
-    rest = []
-    for row in f:
-        if row.lstrip().rstrip().startswith("#"):
-            comments.append(row)
+def load_table(path: str) -> Table:
+    with open(path) as f:
+        reader = CommentedReader(f)
+        if reader.fieldnames is None:
+            raise AssertionError("{} has no fieldnames".format(path))
+        reader.infer_types()
+        return reader, list(reader)
+
+
+def column(table: Table, field: str) -> Any:
+    reader, rows = table
+    ix = reader.index(field)
+    return reader.types.array(ix, [r[ix] for r in rows])
+
+
+def match_rows(left: Any, right: Any, how: str) -> Tuple[Any, Any]:
+    import numpy as np
+
+    # indices of the paired left and right rows, using a binary search of
+    # the sorted right-side keys for every left-side key
+    order = np.argsort(right, kind="stable")
+    keys = right[order]
+    if not len(keys):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    last = len(keys) - 1
+    if how == "backward":
+        pos = np.searchsorted(keys, left, side="right") - 1
+        found = pos >= 0
+    else:
+        pos = np.minimum(np.searchsorted(keys, left), last)
+        if how == "nearest":
+            before = np.maximum(pos - 1, 0)
+            closer = np.abs(keys[before] - left) <= np.abs(keys[pos] - left)
+            pos = np.where(closer, before, pos)
+            found = np.ones(len(left), dtype=bool)
         else:
-            rest.append(row)
-    return csv.reader(comments), csv.reader(rest)
+            found = keys[pos] == left
+    return np.nonzero(found)[0], order[pos[found]]
+
+
+def apply_operation(operation: Callable, lhs: Any, rhs: Any) -> Any:
+    import numpy as np
+
+    result = operation(lhs, rhs)
+    if result.dtype.kind == "i":
+        # int64 wraps around silently, redo with Python ints if it might have
+        estimate = operation(lhs.astype(np.float64), rhs.astype(np.float64))
+        if np.any(np.abs(estimate) >= 2.0**63):
+            result = operation(lhs.astype(object), rhs.astype(object))
+    return result
+
+
+def operate_columns(args: argparse.Namespace) -> None:
+    import numpy as np
+
+    left = load_table(args.source_files[0])
+    right = load_table(args.source_files[1])
+    fieldnames = left[0].fieldnames
+    fields = [k for k in fieldnames if k in args.fields]
+    if args.key is None:
+        if len(left[1]) != len(right[1]):
+            raise AssertionError("Files must have the same number of rows")
+        if len(fieldnames) != len(right[0].fieldnames):
+            raise AssertionError("Rows must have the same number of columns")
+        lix = rix = np.arange(len(left[1]))
+    else:
+        lix, rix = match_rows(
+            column(left, args.key), column(right, args.key), args.match
+        )
+        if len(lix) < len(left[1]):
+            log(len(left[1]) - len(lix), "left-side rows without a match were dropped")
+    # fail on a division by zero like the row-by-row mode does
+    with np.errstate(divide="raise", invalid="raise"):
+        results = [
+            (
+                fieldnames.index(k),
+                apply_operation(
+                    args.operation, column(left, k)[lix], column(right, k)[rix]
+                ).tolist(),
+            )
+            for k in fields
+        ]
+    with output_to(args.output) as of:
+        writer = csv.writer(of)
+        writer.writerow(fieldnames)
+        for i, li in enumerate(lix.tolist()):
+            row = left[1][li]
+            for ix, values in results:
+                row[ix] = values[i]
+            writer.writerow(row)
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Erase first data row from a CSV file")
+    parser = argparse.ArgumentParser(
+        description="Operate on the fields of two CSV files row by row"
+    )
     args = add_arguments(parser).parse_args()
     args.operation = _get_operation(args.operation)
+    if args.numpy or args.key is not None:
+        operate_columns(args)
+        return
     with open(args.source_files[0]) as fleft, open(args.source_files[1]) as fright:
-        rdr_left = csv.DictReader(r for r in fleft if not r.lstrip().startswith("#"))
-        rdr_right = csv.DictReader(r for r in fright if not r.lstrip().startswith("#"))
+        rdr_left = CommentedReader(fleft)
+        rdr_right = CommentedReader(fright)
+        fields = [k for k in args.fields if k in (rdr_left.fieldnames or [])]
+        conv_left = {k: rdr_left.converter(k) for k in fields}
+        conv_right = {
+            k: rdr_right.converter(k) for k in fields if k in rdr_right.fieldnames
+        }
         # forward excluded columens from left-side file
         with output_to(args.output) as of:
             writer = csv.DictWriter(of, rdr_left.fieldnames)
             writer.writeheader()
-            for rl, rr in zip_longest(rdr_left, rdr_right, fillvalue=None):
+            for rl, rr in zip_longest(
+                rdr_left.dicts(), rdr_right.dicts(), fillvalue=None
+            ):
                 if rl is None or rr is None:
                     raise AssertionError("Files must have the same number of rows")
                 if len(rl) != len(rr):
                     raise AssertionError("Rows must have the same number of columns")
                 newrow = {
-                    k: args.operation(_int_or_float(v), _int_or_float(rr[k]))
+                    k: args.operation(conv_left[k](v), conv_right[k](rr[k]))
                     if k in args.fields
                     else v
                     for (k, v) in rl.items()
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+import ast
 import csv
+import operator
+import re
 import sys
-from typing import Any, Callable, Optional, Union
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from commented_csv import CommentedReader, int_or_float
+
+CHUNK_ROWS = 1 << 14
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -14,13 +22,6 @@ def output_to(path: Optional[str]) -> Any:
     return sys.stdout if not path else open(path, "w")
 
 
-def _int_or_float(x: str):
-    try:
-        return int(x)
-    except ValueError:
-        return float(x)
-
-
 def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     def _split_values(x: str, sep=","):
         return x.split(sep)
@@ -46,7 +47,7 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         "--fields",
         action="store",
         help="CSV fields",
-        required=True,
+        required=False,
         type=_split_values,
         default=None,
     )
@@ -55,7 +56,7 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         action="store",
         help="values to use on each field entry",
         required=False,
-        type=lambda x: [_int_or_float(i) for i in _split_values(x)],
+        type=lambda x: [int_or_float(i) for i in _split_values(x)],
         default=None,
     )
     parser.add_argument(
@@ -71,7 +72,7 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         "--operation",
         action="store",
         help="operation to perform on column values",
-        required=True,
+        required=False,
         choices=("sub", "add", "mul", "div"),
         type=str,
     )
@@ -84,6 +85,19 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default="right",
     )
+    parser.add_argument(
+        "-e",
+        "--expr",
+        action="append",
+        help="NAME = EXPRESSION computed for every row, replacing --fields and "
+        "--operation; may be repeated or separated by ';'. Columns are named "
+        "as is or in braces ({power/energy-pkg/}), NAME[0] is the first-row "
+        "value and NAME[-1] the previous-row one (the row itself on the first "
+        "row); + - * / ** abs() and cumsum() are available",
+        required=False,
+        type=str,
+        default=None,
+    )
     return parser
 
 
@@ -111,40 +125,256 @@ def _apply_operation(
     return func(lhs, rhs)
 
 
+Node = Callable[["Context"], Any]
+# (column key, expression) in evaluation order, the input fields used and
+# the key each output column finally refers to
+Plan = Tuple[List[Tuple[str, Node]], Set[str], Dict[str, str]]
+
+_BRACED = re.compile(r"\{([^{}]+)\}")
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+_UNARY = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+
+class Context:
+    # columns are keyed by version, so "x = x - x[-1]" still finds the
+    # previous value of the input x at the start of the next chunk
+    def __init__(self) -> None:
+        self.columns: Dict[str, Any] = {}
+        self.rows = 0
+        self.first: Dict[str, Any] = {}
+        # last value of every column in the previous chunk
+        self.last: Dict[str, Any] = {}
+
+    def previous(self, key: str) -> Any:
+        import numpy as np
+
+        col = self.columns[key]
+        return np.concatenate(([self.last.get(key, col[0])], col[:-1]))
+
+    def end_chunk(self) -> None:
+        for key, col in self.columns.items():
+            self.first.setdefault(key, col[0])
+            self.last[key] = col[-1]
+
+
+def _binary(op: Callable, lhs: Any, rhs: Any) -> Any:
+    import numpy as np
+
+    # x / 0 gives inf or nan: e.g. "time - time[0]" is 0 on the first row
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = op(lhs, rhs)
+    if op is not operator.truediv and np.asarray(result).dtype.kind == "i":
+        # int64 wraps around silently, redo with Python ints if it might have
+        estimate = op(np.asarray(lhs, dtype=float), np.asarray(rhs, dtype=float))
+        if np.any(np.abs(estimate) >= 2.0**63):
+            result = op(np.asarray(lhs, dtype=object), np.asarray(rhs, dtype=object))
+    return result
+
+
+def _compile_node(
+    node: ast.AST, names: Dict[str, str], scope: Dict[str, str], inputs: Set[str]
+) -> Node:
+    import numpy as np
+
+    def key(ident: str) -> str:
+        name = names.get(ident, ident)
+        if name not in scope:
+            raise AssertionError("{} is not a valid fieldname".format(name))
+        if scope[name] == name:
+            inputs.add(name)
+        return scope[name]
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        value = node.value
+        return lambda ctx: value
+    if isinstance(node, ast.Name):
+        k = key(node.id)
+        return lambda ctx: ctx.columns[k]
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+        k = key(node.value.id)
+        try:
+            index = node.slice
+            if not isinstance(index, ast.expr):  # ast.Index before Python 3.9
+                index = index.value
+            row = ast.literal_eval(index)
+        except ValueError:
+            row = None
+        if row not in (0, -1) or isinstance(row, bool):
+            raise AssertionError("Only [0] and [-1] row references are supported")
+        if row == 0:
+            return lambda ctx: ctx.first.get(k, ctx.columns[k][0])
+        return lambda ctx: ctx.previous(k)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        op = _BINARY[type(node.op)]
+        lhs = _compile_node(node.left, names, scope, inputs)
+        rhs = _compile_node(node.right, names, scope, inputs)
+        return lambda ctx: _binary(op, lhs(ctx), rhs(ctx))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        op = _UNARY[type(node.op)]
+        operand = _compile_node(node.operand, names, scope, inputs)
+        return lambda ctx: op(operand(ctx))
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id in ("abs", "cumsum")
+        and len(node.args) == 1
+        and not node.keywords
+    ):
+        arg = _compile_node(node.args[0], names, scope, inputs)
+        if node.func.id == "abs":
+            return lambda ctx: np.abs(arg(ctx))
+        # running total of this call, carried over to the next chunk
+        total: Any = 0
+
+        def cumsum(ctx: Context) -> Any:
+            nonlocal total
+            # a scalar adds up once per row
+            values = np.broadcast_to(arg(ctx), (ctx.rows,))
+            if values.dtype.kind == "i":
+                # int64 wraps around silently, as in _binary: the total
+                # carries on in Python ints once it might have
+                estimate = np.cumsum(values, dtype=float) + float(total)
+                if np.any(np.abs(estimate) >= 2.0**63):
+                    values = values.astype(object)
+            result = np.cumsum(values) + total
+            total = result[-1]
+            return result
+
+        return cumsum
+    raise AssertionError(
+        "Unsupported expression {} at column {}".format(
+            type(node).__name__, node.col_offset + 1
+        )
+    )
+
+
+def compile_expressions(exprs: List[str], fieldnames: List[str]) -> Plan:
+    steps = []
+    inputs: Set[str] = set()
+    scope = {x: x for x in fieldnames}
+    for text in (e for x in exprs for e in x.split(";") if e.strip()):
+        target, sep, body = text.partition("=")
+        if not sep:
+            raise AssertionError("Expression {} must be NAME = EXPRESSION".format(text))
+        target = target.strip()
+        if target.startswith("{") and target.endswith("}"):
+            target = target[1:-1]
+        names: Dict[str, str] = {}
+
+        def placeholder(m: "re.Match") -> str:
+            ident = "_column{}".format(len(names))
+            names[ident] = m.group(1)
+            return ident
+
+        try:
+            tree = ast.parse(_BRACED.sub(placeholder, body.strip()), mode="eval")
+        except SyntaxError as err:
+            raise AssertionError(
+                "Invalid expression {}: {}".format(body.strip(), err.msg)
+            )
+        node = _compile_node(tree.body, names, scope, inputs)
+        scope[target] = "{}#{}".format(target, len(steps))
+        steps.append((scope[target], node))
+    outputs = {t: k for t, k in scope.items() if k != t}
+    return steps, inputs, outputs
+
+
+def evaluate_expressions(reader: CommentedReader, plan: Plan, of: Any) -> None:
+    import numpy as np
+
+    steps, inputs, outputs = plan
+    fieldnames = list(reader.fieldnames or [])
+    fieldnames.extend(t for t in outputs if t not in fieldnames)
+    width = len(fieldnames)
+    types = reader.infer_types()
+    ctx = Context()
+    writer = csv.writer(of)
+    writer.writerow(fieldnames)
+    rows = iter(reader)
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        ctx.columns = {
+            name: types.array(
+                reader.index(name), [r[reader.index(name)] for r in chunk]
+            )
+            for name in inputs
+        }
+        ctx.rows = len(chunk)
+        for key, node in steps:
+            value = node(ctx)
+            if not getattr(value, "shape", ()):
+                value = np.full(len(chunk), value)
+            ctx.columns[key] = value
+        ctx.end_chunk()
+        values = [
+            (fieldnames.index(t), getattr(v, "tolist", lambda: v)())
+            for t, v in ((t, ctx.columns[k]) for t, k in outputs.items())
+        ]
+        for i, row in enumerate(chunk):
+            row.extend([""] * (width - len(row)))
+            for ix, col in values:
+                row[ix] = col[i]
+        writer.writerows(chunk)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Operate on CSV fields")
     args = add_arguments(parser).parse_args()
+    if args.expr:
+        if args.fields or args.values or args.operation:
+            parser.error(
+                "-e/--expr cannot be combined with --fields/--values/--operation"
+            )
+        with read_from(args.source_file) as f:
+            csvrdr = CommentedReader(f, delimiter=args.separator)
+            if csvrdr.fieldnames is None:
+                raise AssertionError("File has no fieldnames")
+            plan = compile_expressions(args.expr, csvrdr.fieldnames)
+            with output_to(args.output) as of:
+                evaluate_expressions(csvrdr, plan, of)
+        return
+    if args.fields is None or args.operation is None:
+        parser.error("--fields and --operation are required without -e/--expr")
     if args.values is not None and len(args.values) != len(args.fields):
         raise AssertionError("values count must equal fields count")
+    operation = _get_operation(args.operation)
+    lhs_operand = args.operand == "left"
     with read_from(args.source_file) as f:
-        csvrdr = csv.DictReader(
-            (r for r in f if not r.lstrip().rstrip().startswith("#")),
-            delimiter=args.separator,
-        )
-        if not all(x in csvrdr.fieldnames for x in args.fields):
+        csvrdr = CommentedReader(f, delimiter=args.separator)
+        if not all(x in (csvrdr.fieldnames or []) for x in args.fields):
             raise AssertionError("All fields must exist in CSV file")
         with output_to(args.output) as of:
             csvwrt = csv.DictWriter(of, fieldnames=csvrdr.fieldnames)
             csvwrt.writeheader()
-            first_row = next(iter(csvrdr), None)
+            convert = {x: csvrdr.converter(x) for x in args.fields}
+            rows = csvrdr.dicts()
+            first_row = next(rows, None)
             if first_row is not None:
                 if args.values is None:
-                    args.values = [_int_or_float(first_row[x]) for x in args.fields]
+                    args.values = [convert[x](first_row[x]) for x in args.fields]
                 for field, value in zip(args.fields, args.values):
                     first_row[field] = _apply_operation(
-                        _get_operation(args.operation),
-                        _int_or_float(first_row[field]),
+                        operation,
+                        convert[field](first_row[field]),
                         value,
-                        args.operand == "left",
+                        lhs_operand,
                     )
                 csvwrt.writerow(first_row)
-                for row in csvrdr:
+                for row in rows:
                     for field, value in zip(args.fields, args.values):
                         row[field] = _apply_operation(
-                            _get_operation(args.operation),
-                            _int_or_float(row[field]),
+                            operation,
+                            convert[field](row[field]),
                             value,
-                            args.operand == "left",
+                            lhs_operand,
                         )
                     csvwrt.writerow(row)
 
@@ -2,10 +2,16 @@
 
 import argparse
 import csv
-import random
 import sys
-import statistics as stat
-from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from commented_csv import ColumnTypes, CommentedReader
+
+# rows handled per numpy call, rounded down to a multiple of the factor
+CHUNK_ROWS = 1 << 16
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -38,9 +44,35 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         "--factor",
         action="store",
         help="integer factor to compact dataset by (>= 1)",
-        required=True,
+        required=False,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--bucket-ns",
+        action="store",
+        help="compact the rows falling into each window of this duration, in "
+        "units of TIME_FIELD (ns for perf and profiler output), instead of by "
+        "FACTOR rows",
+        required=False,
         type=int,
-        default=1,
+        default=None,
+    )
+    parser.add_argument(
+        "--time-field",
+        action="store",
+        help="CSV field with the sample times (default: %(default)s)",
+        required=False,
+        type=str,
+        default="time",
+    )
+    parser.add_argument(
+        "--value-field",
+        action="store",
+        help="CSV field whose shape against TIME_FIELD --mode lttb preserves",
+        required=False,
+        type=str,
+        default=None,
     )
     parser.add_argument(
         "--start",
@@ -61,122 +93,476 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
         "--mode",
         action="store",
-        choices=("avg", "first", "random"),
-        help="compact by FACTOR using specific method",
+        choices=(
+            "avg",
+            "first",
+            "last",
+            "random",
+            "min",
+            "max",
+            "median",
+            "sum",
+            "lttb",
+            "reservoir",
+        ),
+        help="compact by FACTOR or BUCKET_NS using specific method (integer "
+        "columns stay integers, rounded half to even; lttb keeps the row of "
+        "the largest triangle, see Steinarsson 2013; reservoir keeps SIZE rows "
+        "drawn uniformly from the whole range)",
         required=False,
         default="first",
     )
+    parser.add_argument(
+        "--size",
+        action="store",
+        help="number of rows --mode reservoir keeps (per STRATIFY value)",
+        required=False,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--stratify",
+        action="store",
+        help="CSV field whose values --mode reservoir samples separately",
+        required=False,
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        help="seed of the random modes, for reproducible output",
+        required=False,
+        type=int,
+        default=None,
+    )
     return parser
 
 
-def int_or_float(x: str):
+Row = List[Any]
+
+
+def _round_half_even(q: np.ndarray, r: np.ndarray, n: Any) -> np.ndarray:
+    # q + r / n (0 <= r < n) rounded to an integer, as round() does
+    return q + ((2 * r > n) | ((2 * r == n) & (q % 2 == 1)))
+
+
+def _int_mean(blocks: np.ndarray) -> np.ndarray:
+    # exact: offsets from the first value of each block cannot overflow
+    base = blocks[:, 0, :]
+    q, r = np.divmod((blocks - base[:, None, :]).sum(axis=1), blocks.shape[1])
+    return _round_half_even(q + base, r, blocks.shape[1])
+
+
+def _int_median(blocks: np.ndarray) -> np.ndarray:
+    ordered = np.sort(blocks, axis=1)
+    n = blocks.shape[1]
+    lo, hi = ordered[:, (n - 1) // 2, :], ordered[:, n // 2, :]
+    q, r = np.divmod(hi - lo, 2)
+    return _round_half_even(lo + q, r, 2)
+
+
+def _int_sum(blocks: np.ndarray) -> np.ndarray:
+    if np.any(np.abs(blocks.astype(float).sum(axis=1)) >= 2.0**63):
+        return blocks.astype(object).sum(axis=1)
+    return blocks.sum(axis=1)
+
+
+def _float_sum(blocks: np.ndarray) -> np.ndarray:
+    # summed in extended precision, so the result is rounded once like
+    # statistics.mean (where long double is wider than double)
+    return blocks.astype(np.longdouble).sum(axis=1)
+
+
+def _float_mean(blocks: np.ndarray) -> np.ndarray:
+    return (_float_sum(blocks) / blocks.shape[1]).astype(np.float64)
+
+
+# (integer reducer, float reducer) over axis 1 of (blocks, factor, columns)
+REDUCERS: Dict[str, Any] = {
+    "avg": (_int_mean, _float_mean),
+    "median": (_int_median, lambda b: np.median(b, axis=1)),
+    "sum": (_int_sum, lambda b: _float_sum(b).astype(np.float64)),
+}
+# pick one of the rows of each block, as written in the input
+SELECTORS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "min": lambda b: b.argmin(axis=1),
+    "max": lambda b: b.argmax(axis=1),
+}
+
+
+def _pad(row: Row, width: int) -> Row:
+    return row + [""] * (width - len(row)) if len(row) < width else row
+
+
+def _raw(rows: List[Row], width: int) -> np.ndarray:
+    raw = np.empty((len(rows), width), dtype=object)
     try:
-        return int(x)
+        raw[:] = rows
     except ValueError:
-        return float(x)
+        raise AssertionError("Rows must have {} fields".format(width))
+    return raw
 
 
-def yield_or_write_rows_predicate(infile: Any, outfile: Any, pred: Callable):
-    for row in infile:
-        if pred(row):
-            yield row
+def reduce_blocks(
+    rows: List[Row], factor: int, mode: str, types: ColumnTypes, width: int
+) -> List[Row]:
+    count = len(rows) // factor
+    raw = _raw(rows, width)
+    columns = [types.array(ix, raw[:, ix].tolist()) for ix in range(width)]
+    groups: Dict[str, List[int]] = {"i": [], "f": []}
+    for ix, col in enumerate(columns):
+        groups["i" if col.dtype.kind == "i" else "f"].append(ix)
+    out = raw.reshape(count, factor, width)[:, 0, :].copy()
+    for kind, ixs in groups.items():
+        if not ixs:
+            continue
+        blocks = np.stack([columns[ix] for ix in ixs], axis=-1)
+        blocks = blocks.astype(np.int64 if kind == "i" else np.float64)
+        blocks = blocks.reshape(count, factor, len(ixs))
+        if mode in SELECTORS:
+            picked = SELECTORS[mode](blocks)[:, None, :]
+            values = raw.reshape(count, factor, width)[:, :, ixs]
+            out[:, ixs] = np.take_along_axis(values, picked, axis=1)[:, 0, :]
         else:
-            print(row, file=outfile, end="")
+            out[:, ixs] = REDUCERS[mode][0 if kind == "i" else 1](blocks)
+    return out.tolist()
 
 
-def yield_inside_interval(
-    reader: csv.DictReader, writer: csv.DictWriter, start: int, end: int
-):
-    for idx, row in enumerate(reader, start=0):
-        if idx >= start and idx <= end:
+def yield_last_row(rows: Iterable[Row], factor: int) -> Iterator[Row]:
+    idx = -1
+    row = None
+    for idx, row in enumerate(rows):
+        if idx % factor == factor - 1:
             yield row
-        elif idx == end + 1:
-            yield None
-            writer.writerow(row)
+    if idx % factor != factor - 1:
+        yield row
+
+
+def yield_reduced(
+    rows: Iterator[Row], factor: int, mode: str, types: ColumnTypes, width: int
+) -> Iterator[Row]:
+    size = max(1, CHUNK_ROWS // factor) * factor
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            break
+        full = len(chunk) - len(chunk) % factor
+        if full:
+            yield from reduce_blocks(chunk[:full], factor, mode, types, width)
+        if full < len(chunk):
+            rest = chunk[full:]
+            yield from reduce_blocks(rest, len(rest), mode, types, width)
+
+
+def compact_rows(
+    rows: Iterator[Row], factor: int, mode: str, types: ColumnTypes, width: int
+) -> Iterator[Row]:
+    # selections stream, so comments between rows keep their place
+    if mode == "first":
+        selected = islice(rows, 0, None, factor)
+    elif mode == "last":
+        selected = yield_last_row(rows, factor)
+    else:
+        return yield_reduced(rows, factor, mode, types, width)
+    return (_pad(r, width) for r in selected)
+
+
+def reduce_segments(
+    rows: List[Row],
+    starts: np.ndarray,
+    mode: str,
+    types: ColumnTypes,
+    width: int,
+    rng: np.random.Generator,
+) -> List[Row]:
+    # same reductions as reduce_blocks, over buckets of any size
+    lengths = np.diff(np.append(starts, len(rows)))
+    if mode in ("first", "last", "random"):
+        if mode == "first":
+            picked = starts
+        elif mode == "last":
+            picked = starts + lengths - 1
+        else:
+            # one draw per bucket, in a single call
+            picked = starts + rng.integers(0, lengths)
+        return [_pad(rows[i], width) for i in picked.tolist()]
+    raw = _raw(rows, width)
+    ids = np.repeat(np.arange(len(starts)), lengths)
+    out = raw[starts].copy()
+    for ix in range(width):
+        col = types.array(ix, raw[:, ix].tolist())
+        is_int = col.dtype.kind == "i"
+        if not is_int:
+            col = col.astype(np.float64)
+        if mode in ("min", "max"):
+            order = np.lexsort((col if mode == "min" else -col, ids))
+            out[:, ix] = raw[order[starts], ix]
+        elif mode == "median":
+            order = np.lexsort((col, ids))
+            lo = col[order[starts + (lengths - 1) // 2]]
+            hi = col[order[starts + lengths // 2]]
+            if is_int:
+                q, r = np.divmod(hi - lo, 2)
+                out[:, ix] = _round_half_even(lo + q, r, 2)
+            else:
+                out[:, ix] = (lo + hi) / 2
+        elif mode == "avg" and is_int:
+            base = col[starts]
+            total = np.add.reduceat(col - np.repeat(base, lengths), starts)
+            q, r = np.divmod(total, lengths)
+            out[:, ix] = _round_half_even(q + base, r, lengths)
+        elif mode == "avg":
+            total = np.add.reduceat(col.astype(np.longdouble), starts)
+            out[:, ix] = (total / lengths).astype(np.float64)
+        elif is_int:
+            estimate = np.add.reduceat(col.astype(np.float64), starts)
+            if np.any(np.abs(estimate) >= 2.0**63):
+                col = col.astype(object)
+            out[:, ix] = np.add.reduceat(col, starts)
         else:
-            writer.writerow(row)
+            total = np.add.reduceat(col.astype(np.longdouble), starts)
+            out[:, ix] = total.astype(np.float64)
+    return out.tolist()
 
 
-def yield_first_row(rows: Iterable, factor: int):
-    for idx, row in enumerate(rows, start=0):
-        if row is not None and idx % factor == 0:
-            yield row
+Point = Tuple[float, float]
 
 
-def yield_random_row(rows: Iterable, factor: int):
-    rng_idx: int = random.randint(0, factor - 1)
-    for idx, row in enumerate(rows, start=0):
-        if row is not None and idx % factor == rng_idx:
-            yield row
+def select_lttb(
+    x: np.ndarray,
+    y: np.ndarray,
+    starts: np.ndarray,
+    previous: Optional[Point],
+    following: Optional[Point],
+) -> Tuple[List[int], Optional[Point]]:
+    # largest triangle three buckets: the row of each bucket that makes the
+    # largest triangle with the row kept in the bucket before and the mean
+    # of the bucket after; the first and last rows are always kept
+    lengths = np.diff(np.append(starts, len(x)))
+    mean_x = np.add.reduceat(x, starts) / lengths
+    mean_y = np.add.reduceat(y, starts) / lengths
+    picked = []
+    for i, (start, end) in enumerate(zip(starts, starts + lengths)):
+        if previous is None:
+            j = start
+        elif i + 1 == len(starts) and following is None:
+            j = end - 1
+        else:
+            cx, cy = (
+                (mean_x[i + 1], mean_y[i + 1]) if i + 1 < len(starts) else following
+            )
+            ax, ay = previous
+            area = np.abs(
+                (ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay)
+            )
+            j = start + int(area.argmax())
+        picked.append(int(j))
+        previous = (x[j], y[j])
+    return picked, previous
+
+
+def yield_buckets(
+    rows: Iterator[Row],
+    bucket_of: Callable[[List[Row], int], np.ndarray],
+    mode: str,
+    types: ColumnTypes,
+    width: int,
+    rng: np.random.Generator,
+    lttb_ixs: Optional[Tuple[int, int]] = None,
+) -> Iterator[Row]:
+    # the last bucket of a chunk (and for lttb the one before, whose
+    # successor must be complete) is carried over to the next chunk
+    keep = 1 if lttb_ixs is None else 2
+    pending: List[Row] = []
+    offset = 0
+    previous: Optional[Point] = None
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        block = pending + chunk
+        if not block:
+            break
+        ids = bucket_of(block, offset)
+        if np.any(ids[1:] < ids[:-1]):
+            raise AssertionError("Rows must be sorted by time")
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        if chunk and len(starts) <= keep:
+            pending = block
+            continue
+        done = len(starts) - keep if chunk else len(starts)
+        split = int(starts[done]) if done < len(starts) else len(block)
+        if lttb_ixs is None:
+            yield from reduce_segments(
+                block[:split], starts[:done], mode, types, width, rng
+            )
+        else:
+            tix, vix = lttb_ixs
+            x = types.array(tix, [r[tix] for r in block]).astype(np.float64)
+            y = types.array(vix, [r[vix] for r in block]).astype(np.float64)
+            following = None
+            if done < len(starts):
+                end = starts[done + 1] if done + 1 < len(starts) else len(block)
+                following = (x[split:end].mean(), y[split:end].mean())
+            picked, previous = select_lttb(
+                x[:split], y[:split], starts[:done], previous, following
+            )
+            yield from (_pad(block[i], width) for i in picked)
+        pending = block[split:]
+        offset += split
+        if not chunk:
+            break
+
+
+def row_buckets(factor: int) -> Callable[[List[Row], int], np.ndarray]:
+    def bucket_of(rows: List[Row], offset: int) -> np.ndarray:
+        return np.arange(offset, offset + len(rows)) // factor
+
+    return bucket_of
+
+
+def time_buckets(
+    types: ColumnTypes, ix: int, bucket_ns: int
+) -> Callable[[List[Row], int], np.ndarray]:
+    origin = None
+
+    def bucket_of(rows: List[Row], offset: int) -> np.ndarray:
+        nonlocal origin
+        times = types.array(ix, [r[ix] for r in rows])
+        if origin is None:
+            origin = times[0]
+        return ((times - origin) // bucket_ns).astype(np.int64)
+
+    return bucket_of
 
 
-def yield_average(rows: Iterable, factor: int):
-    RowType = Dict[str, str]
-    RowTypeNumeric = Dict[str, Union[int, float]]
-
-    def compute_average(rows: List[RowType]) -> RowTypeNumeric:
-        def yield_column_values(rows: List[RowType], key: str):
-            for row in rows:
-                yield int_or_float(row[key])
-
-        assert len(rows) > 0
-        first_row = rows[0]
-        for k in first_row:
-            mean = stat.mean(data=yield_column_values(rows, k))
-            if isinstance(int_or_float(first_row[k]), int):
-                mean = int(round(mean))
-            first_row[k] = mean
-        return first_row
-
-    factor_init = factor
-    rows_to_process: List[RowType] = []
-    for idx, row in enumerate(rows, start=0):
-        if row is None:
-            yield compute_average(rows_to_process)
-        elif idx < factor:
-            rows_to_process.append(row)
-        elif idx == factor:
-            factor += factor_init
-            yield compute_average(rows_to_process)
-            rows_to_process.clear()
-            rows_to_process.append(row)
+class Reservoir:
+    # Algorithm R, with the random slots of a whole chunk drawn at once
+    def __init__(self, size: int, rng: np.random.Generator) -> None:
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.items: List[Tuple[int, Row]] = []
+
+    def add(self, rows: List[Row], indices: np.ndarray) -> None:
+        fill = min(max(self.size - len(self.items), 0), len(rows))
+        self.items.extend(zip(indices[:fill].tolist(), rows[:fill]))
+        if fill < len(rows):
+            # item number k (from 0) replaces a slot with probability SIZE / (k + 1)
+            slots = self.rng.integers(0, self.seen + np.arange(fill, len(rows)) + 1)
+            for i in np.flatnonzero(slots < self.size).tolist():
+                self.items[slots[i]] = (int(indices[fill + i]), rows[fill + i])
+        self.seen += len(rows)
+
+
+def yield_reservoir(
+    rows: Iterator[Row],
+    size: int,
+    rng: np.random.Generator,
+    width: int,
+    stratum_ix: Optional[int] = None,
+) -> Iterator[Row]:
+    reservoirs: Dict[str, Reservoir] = {}
+    offset = 0
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        indices = np.arange(offset, offset + len(chunk))
+        if stratum_ix is None:
+            reservoirs.setdefault("", Reservoir(size, rng)).add(chunk, indices)
+        else:
+            strata: Dict[str, List[int]] = {}
+            for i, row in enumerate(chunk):
+                strata.setdefault(row[stratum_ix], []).append(i)
+            for key, ixs in strata.items():
+                reservoirs.setdefault(key, Reservoir(size, rng)).add(
+                    [chunk[i] for i in ixs], indices[ixs]
+                )
+        offset += len(chunk)
+    # kept rows come out in their input order
+    items = sorted(x for r in reservoirs.values() for x in r.items)
+    return (_pad(row, width) for _, row in items)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Compact CSV dataset")
     args = add_arguments(parser).parse_args()
-    if args.factor < 1:
+    if args.mode == "reservoir":
+        if args.size is None or args.size < 1:
+            parser.error("--mode reservoir requires --size >= 1")
+        if args.factor is not None or args.bucket_ns is not None:
+            parser.error("--mode reservoir takes --size instead of a factor")
+    elif (args.factor is None) == (args.bucket_ns is None):
+        parser.error("exactly one of --factor and --bucket-ns is required")
+    if args.stratify is not None and args.mode != "reservoir":
+        parser.error("--stratify only applies to --mode reservoir")
+    if args.factor is not None and args.factor < 1:
         raise argparse.ArgumentTypeError("FACTOR must be >= 1")
+    if args.bucket_ns is not None and args.bucket_ns < 1:
+        raise argparse.ArgumentTypeError("BUCKET_NS must be >= 1")
+    if args.mode == "lttb" and args.value_field is None:
+        parser.error("--mode lttb requires --value-field")
     if args.start < 0:
         raise argparse.ArgumentTypeError("START must be >= 0")
     if args.end <= args.start:
         raise argparse.ArgumentTypeError("END must be > START")
     with read_from(args.source_file) as f:
         with output_to(args.output) as of:
-            if args.factor == 1:
+            if args.factor == 1 and args.mode != "lttb":
                 for row in f:
                     print(row, file=of, end="")
             else:
-                csvrdr = csv.DictReader(
-                    yield_or_write_rows_predicate(
-                        f, of, lambda x: not x.strip().startswith("#")
-                    )
+                csvrdr = CommentedReader(
+                    f, on_comment=lambda x: print(x, file=of, end="")
                 )
-                csvwrt = csv.DictWriter(
-                    of, fieldnames=csvrdr.fieldnames, dialect=csvrdr.dialect
-                )
-                csvwrt.writeheader()
-                rows_inside = yield_inside_interval(
-                    csvrdr, csvwrt, args.start, args.end
-                )
-                if args.mode == "first":
-                    csvwrt.writerows(yield_first_row(rows_inside, args.factor))
-                elif args.mode == "avg":
-                    csvwrt.writerows(yield_average(rows_inside, args.factor))
-                elif args.mode == "random":
-                    csvwrt.writerows(yield_random_row(rows_inside, args.factor))
+                if csvrdr.fieldnames is None:
+                    raise AssertionError("File has no fieldnames")
+                for line in csvrdr.meta_lines:
+                    print(line, file=of, end="")
+                width = len(csvrdr.fieldnames)
+                csvwrt = csv.writer(of)
+                csvwrt.writerow(csvrdr.fieldnames)
+                types = csvrdr.infer_types()
+                rows = iter(csvrdr)
+                # rows outside of [START, END] are written as they are
+                csvwrt.writerows(_pad(r, width) for r in islice(rows, args.start))
+                inside = islice(rows, min(args.end, sys.maxsize - 1) - args.start + 1)
+                rng = np.random.default_rng(args.seed)
+                if args.mode == "reservoir":
+                    stratum_ix = None
+                    if args.stratify is not None:
+                        stratum_ix = csvrdr.index(args.stratify)
+                    compacted = yield_reservoir(
+                        inside, args.size, rng, width, stratum_ix
+                    )
+                elif args.bucket_ns is None and args.mode not in ("lttb", "random"):
+                    compacted = compact_rows(
+                        inside, args.factor, args.mode, types, width
+                    )
                 else:
-                    assert False
+                    if args.bucket_ns is None:
+                        bucket_of = row_buckets(args.factor)
+                    else:
+                        bucket_of = time_buckets(
+                            types, csvrdr.index(args.time_field), args.bucket_ns
+                        )
+                    lttb_ixs = None
+                    if args.mode == "lttb":
+                        lttb_ixs = (
+                            csvrdr.index(args.time_field),
+                            csvrdr.index(args.value_field),
+                        )
+                    compacted = yield_buckets(
+                        inside,
+                        bucket_of,
+                        args.mode,
+                        types,
+                        width,
+                        rng,
+                        lttb_ixs,
+                    )
+                csvwrt.writerows(compacted)
+                csvwrt.writerows(_pad(r, width) for r in rows)
 
 
 if __name__ == "__main__":
@@ -2,10 +2,35 @@
 
 import argparse
 import csv
+import functools
+import re
 import sys
 import statistics as stat
 import numpy as np
-from typing import Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from commented_csv import CommentedReader
+from path_parameters import DEFAULT_PATTERN, parameters
+from streaming_stats import (
+    RunningCovariance,
+    RunningStats,
+    parse_percentiles,
+    percentile,
+    percentile_label,
+)
+
+Stats = Dict[str, Any]
+Columns = Dict[str, List[Optional[Union[int, float]]]]
+
+LABELS = {
+    "mean": "Mean",
+    "median": "Median",
+    "mode": "Mode",
+    "stddev": "Std. Dev",
+    "variance": "Variance",
+    "r": "R",
+}
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -18,20 +43,28 @@ def output_to(path: Optional[str]) -> Any:
 
 def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
-        "source_file",
+        "source_files",
+        action="store",
+        help="files to extract from (default: stdin)",
+        nargs="*",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
         action="store",
-        help="file to extract from (default: stdin)",
-        nargs="?",
+        help="output file (default: stdout)",
+        required=False,
         type=str,
         default=None,
     )
     parser.add_argument(
         "-f",
         "--field",
-        action="store",
-        help="CSV field/column to analyse",
+        action="extend",
+        help="CSV field(s)/column(s) to analyse, comma-separated or repeated",
         required=True,
-        type=str,
+        type=lambda x: x.split(","),
     )
     parser.add_argument(
         "--corr",
@@ -49,53 +82,267 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        action="store",
+        help="comma-separated percentiles to report, e.g. p50,p95,p99 (default: none)",
+        required=False,
+        type=parse_percentiles,
+        default=[],
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="compute in one pass and constant memory (median and percentiles are estimated)",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        help="number of worker processes for many files (default: CPU count)",
+        required=False,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--pattern",
+        action="store",
+        help="regular expression whose named groups become parameter columns",
+        required=False,
+        type=re.compile,
+        default=re.compile(DEFAULT_PATTERN),
+    )
+    parser.add_argument(
+        "-g",
+        "--group-by",
+        action="store",
+        help="pool the files sharing these comma-separated parameters",
+        required=False,
+        type=lambda x: x.split(","),
+        default=None,
+    )
     return parser
 
 
-def main():
-    def int_or_float(x: str):
-        try:
-            return int(x)
-        except ValueError:
-            return float(x)
+def exact_stats(
+    y: List[Union[int, float]],
+    lr_x: Optional[List[float]],
+    corr_x: Optional[List[float]],
+    percentiles: Sequence[float],
+) -> Stats:
+    mean = stat.mean(y)
+    result = {
+        "count": len(y),
+        "mean": mean,
+        "median": stat.median(y),
+        "mode": stat.mode(y),
+        "stddev": stat.stdev(y),
+        "variance": stat.variance(y, xbar=mean),
+    }
+    for p in percentiles:
+        result[percentile_label(p)] = percentile(y, p)
+    if lr_x is not None:
+        x = np.array(lr_x, dtype=float)
+        A = np.vstack([x, np.ones(len(x))]).T
+        result["lr_m"], result["lr_c"] = np.linalg.lstsq(
+            A, np.array(y, dtype=float), rcond=None
+        )[0]
+    if corr_x is not None:
+        x = np.array(corr_x, dtype=float)
+        result["r"] = np.corrcoef(x, np.array(y, dtype=float))[1, 0]
+    return result
+
+
+def running_stats(
+    stats: RunningStats,
+    lr: Optional[RunningCovariance],
+    corr: Optional[RunningCovariance],
+    percentiles: Sequence[float],
+) -> Stats:
+    result = {
+        "count": stats.count,
+        "mean": stats.mean,
+        "median": stats.percentile(50),
+        "mode": stats.mode,
+        "stddev": stats.stdev,
+        "variance": stats.variance,
+    }
+    for p in percentiles:
+        result[percentile_label(p)] = stats.percentile(p)
+    if lr is not None:
+        result["lr_m"], result["lr_c"] = lr.linear_regression()
+    if corr is not None:
+        result["r"] = corr.correlation()
+    return result
+
+
+def open_reader(f: Any, args: argparse.Namespace) -> CommentedReader:
+    reader = CommentedReader(f)
+    for name in args.field + [x for x in (args.lr, args.corr) if x]:
+        if name not in (reader.fieldnames or []):
+            raise AssertionError("{} is not a valid fieldname".format(name))
+    return reader
+
+
+def read_columns(f: Any, args: argparse.Namespace) -> Columns:
+    reader = open_reader(f, args)
+    names = list(dict.fromkeys(args.field + [x for x in (args.lr, args.corr) if x]))
+    converters = [reader.converter(x) for x in names]
+    cols = reader.columns(names)
+    # empty cells are missing values (e.g. a metric undefined for a window)
+    # and stay None, so the columns still line up row by row
+    for x, convert in zip(names, converters):
+        cols[x] = [convert(v) if v else None for v in cols[x]]
+    return cols
+
+
+def columns_stats(cols: Columns, args: argparse.Namespace) -> Dict[str, Stats]:
+    xs = [x for x in (args.lr, args.corr) if x]
+    result = {}
+    for field in args.field:
+        present = {x: cols[x] for x in [field] + xs}
+        if any(None in col for col in present.values()):
+            # rows missing the field or the column it is compared with are
+            # left out
+            keep = [
+                i for i, row in enumerate(zip(*present.values())) if None not in row
+            ]
+            present = {x: [col[i] for i in keep] for x, col in present.items()}
+        lr_x = [float(v) for v in present[args.lr]] if args.lr else None
+        corr_x = [float(v) for v in present[args.corr]] if args.corr else None
+        result[field] = exact_stats(present[field], lr_x, corr_x, args.percentiles)
+    return result
+
+
+def streaming_stats(f: Any, args: argparse.Namespace) -> Dict[str, Stats]:
+    reader = open_reader(f, args)
+    quantiles = [50] + [p for p in args.percentiles if p != 50]
+    fields = [
+        (
+            field,
+            reader.index(field),
+            reader.converter(field),
+            RunningStats(quantiles),
+            RunningCovariance() if args.lr else None,
+            RunningCovariance() if args.corr else None,
+        )
+        for field in dict.fromkeys(args.field)
+    ]
+    lr_ix = reader.index(args.lr) if args.lr else None
+    corr_ix = reader.index(args.corr) if args.corr else None
+    for row in reader:
+        for _, ix, convert, stats, lr, corr in fields:
+            # empty cells are missing values, as in read_columns
+            if (
+                not row[ix]
+                or (lr is not None and not row[lr_ix])
+                or (corr is not None and not row[corr_ix])
+            ):
+                continue
+            y = convert(row[ix])
+            stats.add(y)
+            if lr is not None:
+                lr.add(float(row[lr_ix]), y)
+            if corr is not None:
+                corr.add(float(row[corr_ix]), y)
+    if not fields[0][3].count:
+        raise AssertionError("File has no data rows")
+    return {
+        field: running_stats(stats, lr, corr, args.percentiles)
+        for field, _, _, stats, lr, corr in fields
+    }
 
+
+def file_stats(path: Optional[str], args: argparse.Namespace) -> Dict[str, Stats]:
+    with read_from(path) as f:
+        if args.streaming:
+            return streaming_stats(f, args)
+        return columns_stats(read_columns(f, args), args)
+
+
+def file_columns(path: Optional[str], args: argparse.Namespace) -> Columns:
+    with read_from(path) as f:
+        return read_columns(f, args)
+
+
+def print_padded(stats: Stats, of: Any, padding: int = 15) -> None:
+    for key, value in stats.items():
+        if key in ("count", "lr_c"):
+            continue
+        if key == "lr_m":
+            print(
+                "{}m = {} c = {}".format(
+                    "Regression".ljust(padding), value, stats["lr_c"]
+                ),
+                file=of,
+            )
+        else:
+            print("{}{}".format(LABELS.get(key, key).ljust(padding), value), file=of)
+
+
+def _natural(x: str) -> Tuple[int, Any]:
+    return (0, int(x)) if x.isdigit() else (1, x)
+
+
+def main():
     parser = argparse.ArgumentParser(
-        description="Output the statistics of a field in a CSV file"
+        description="Output the statistics of fields in one or more CSV files"
     )
     args = add_arguments(parser).parse_args()
-    with read_from(args.source_file) as f:
-        reader = csv.DictReader((r for r in f if not r.strip().startswith("#")))
-        if args.field not in reader.fieldnames:
-            raise AssertionError("{} is not a valid fieldname".format(args.field))
-
-        padding = 15
-
-        data = list(reader)
-        col = [int_or_float(r[args.field]) for r in data]
-        mean = stat.mean(col)
-        print("{}{}".format("Mean".ljust(padding), mean))
-        print("{}{}".format("Median".ljust(padding), stat.median(col)))
-        print("{}{}".format("Mode".ljust(padding), stat.mode(col)))
-        print("{}{}".format("Std. Dev".ljust(padding), stat.stdev(col)))
-        print("{}{}".format("Variance".ljust(padding), stat.variance(col, xbar=mean)))
-
-        if args.lr:
-            if args.lr not in reader.fieldnames:
-                raise AssertionError("{} is not a valid fieldname".format(args.lr))
-            x = np.array([r[args.lr] for r in data], dtype=float)
-            y = np.array(col, dtype=float)
-            A = np.vstack([x, np.ones(len(x))]).T
-
-            m, c = np.linalg.lstsq(A, y, rcond=None)[0]
-            print("{}m = {} c = {}".format("Regression".ljust(padding), m, c))
-
-        if args.corr:
-            if args.corr not in reader.fieldnames:
-                raise AssertionError("{} is not a valid fieldname".format(args.corr))
-            x = np.array([r[args.corr] for r in data], dtype=float)
-            y = np.array(col, dtype=float)
-            r = np.corrcoef(x, y)[1, 0]
-            print("{}{}".format("R".ljust(padding), r))
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be >= 1")
+    if args.group_by and args.streaming:
+        parser.error("-g/--group-by pools exact values and cannot be --streaming")
+    args.field = list(dict.fromkeys(args.field))
+    paths = args.source_files or [None]
+
+    if len(paths) == 1 and len(args.field) == 1 and not args.group_by:
+        stats = file_stats(paths[0], args)
+        with output_to(args.output) as of:
+            print_padded(stats[args.field[0]], of)
+        return
+
+    worker = file_columns if args.group_by else file_stats
+    if len(paths) == 1:
+        results = [worker(paths[0], args)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(functools.partial(worker, args=args), paths))
+
+    params = [parameters(p or "", args.pattern) for p in paths]
+    names = [n for n in args.pattern.groupindex if any(n in p for p in params)]
+    rows = []
+    if args.group_by:
+        unknown = [n for n in args.group_by if n not in args.pattern.groupindex]
+        if unknown:
+            parser.error("unknown parameters: {}".format(", ".join(unknown)))
+        names = args.group_by
+        pooled: Dict[Tuple[str, ...], Columns] = {}
+        for p, cols in zip(params, results):
+            key = tuple(p.get(n, "") for n in names)
+            group = pooled.setdefault(key, {k: [] for k in cols})
+            for k, v in cols.items():
+                group[k].extend(v)
+        for key, cols in pooled.items():
+            for field, stats in columns_stats(cols, args).items():
+                rows.append((dict(zip(names, key)), field, stats))
+    else:
+        for path, p, per_field in zip(paths, params, results):
+            for field, stats in per_field.items():
+                rows.append((dict(p, file=path or ""), field, stats))
+    # rows of the same configuration end up next to each other
+    rows.sort(key=lambda r: [_natural(r[0].get(n, "")) for n in names + ["file"]])
+    if not args.group_by:
+        names = ["file"] + names
+    fieldnames = names + ["field"] + list(rows[0][2]) if rows else names
+    with output_to(args.output) as of:
+        writer = csv.DictWriter(of, fieldnames, restval="")
+        writer.writeheader()
+        for p, field, stats in rows:
+            writer.writerow(dict(p, field=field, **stats))
 
 
 if __name__ == "__main__":
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
-from posixpath import sep
 import sys
-from typing import Any, Optional, Tuple
+from typing import Any, Optional
+
+from commented_csv import CommentedReader
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -54,28 +54,15 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     return parser
 
 
-def read_file(f) -> Tuple[csv.reader, csv.reader]:
-    comments = []
-    rest = []
-    for row in f:
-        if row.lstrip().rstrip().startswith("#"):
-            comments.append(row)
-        else:
-            rest.append(row)
-    return csv.reader(comments), csv.reader(rest)
-
-
 def main():
     parser = argparse.ArgumentParser(description="Output specific field from CSV")
     args = add_arguments(parser).parse_args()
     with read_from(args.source_file) as f:
-        csvrdr = csv.DictReader(
-            (r for r in f if not r.lstrip().rstrip().startswith("#")),
-            delimiter=args.separator,
-        )
+        csvrdr = CommentedReader(f, delimiter=args.separator)
+        ix = csvrdr.index(args.field)
         with output_to(args.output) as of:
             for row in csvrdr:
-                print(row[args.field], file=of, end="\n")
+                print(row[ix], file=of, end="\n")
 
 
 if __name__ == "__main__":
@@ -3,7 +3,9 @@
 import argparse
 import csv
 import sys
-from typing import Any, Optional, Tuple
+from typing import Any, Optional
+
+from commented_csv import CommentedReader, parse_line
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -35,31 +37,25 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     return parser
 
 
-def read_file(f) -> Tuple[csv.reader, csv.reader]:
-    comments = []
-    rest = []
-    for row in f:
-        if row.lstrip().rstrip().startswith("#"):
-            comments.append(row)
-        else:
-            rest.append(row)
-    return csv.reader(comments), csv.reader(rest)
-
-
 def main():
     parser = argparse.ArgumentParser(description="Erase first data row from a CSV file")
     args = add_arguments(parser).parse_args()
     with read_from(args.source_file) as f:
-        comments, data = read_file(f)
         with output_to(args.output) as of:
             writer = csv.writer(of)
-            writer.writerows(comments)
+            data = CommentedReader(
+                f, on_comment=lambda x: writer.writerow(parse_line(x))
+            )
+            if data.fieldnames is None:
+                raise AssertionError("File has no fieldnames")
+            writer.writerows(data.meta)
             # fieldnames
-            writer.writerow(next(iter(data)))
+            writer.writerow(data.fieldnames)
+            rows = iter(data)
             # ignore next row
-            next(iter(data))
+            next(rows, None)
             # rest
-            writer.writerows(data)
+            writer.writerows(rows)
 
 
 if __name__ == "__main__":
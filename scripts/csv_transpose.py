@@ -2,8 +2,21 @@
 
 import argparse
 import csv
+import os
 import sys
-from typing import Any, Callable, Optional
+import tempfile
+from contextlib import ExitStack
+from itertools import chain, islice
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+
+from commented_csv import CommentedReader
+
+# rough size of a parsed cell besides its characters (str object, list slot)
+CELL_OVERHEAD = 64
+MAX_OPEN_FILES = 128
+BLOCK_ROWS = 1 << 12
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -32,12 +45,88 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "-m",
+        "--memory",
+        action="store",
+        help="MiB of rows to hold before spilling transposed blocks to "
+        "temporary files (default: %(default)s)",
+        required=False,
+        type=int,
+        default=512,
+    )
+    parser.add_argument(
+        "--temp-dir",
+        action="store",
+        help="directory for the spilled blocks (default: system temporary directory)",
+        required=False,
+        type=str,
+        default=None,
+    )
     return parser
 
 
-def yield_or_write_rows_predicate(infile: Any, outfile: Any, pred: Callable):
-    for row in infile:
-        yield row if pred(row) else print(row, file=outfile, end="")
+def transpose(rows: List[List[str]], width: int) -> List[List[str]]:
+    data = np.empty((len(rows), width), dtype=object)
+    if max(map(len, rows)) == width:
+        data[:] = rows
+    else:
+        # rows longer than the first one are cut to its width
+        for i, row in enumerate(rows):
+            data[i] = row[:width]
+    return data.T.tolist()
+
+
+def write_rows(f: Any, rows: Iterable[List[str]], lineterminator: str = "\r\n") -> None:
+    writer = csv.writer(f, lineterminator=lineterminator)
+    for row in rows:
+        line = ",".join(row)
+        # nothing to quote, the line is what csv.writer would write
+        if (
+            len(row) > 1
+            and line.count(",") == len(row) - 1
+            and '"' not in line
+            and "\n" not in line
+            and "\r" not in line
+        ):
+            f.write(line + lineterminator)
+        else:
+            writer.writerow(row)
+
+
+def spill(rows: Iterable[List[str]], directory: str) -> str:
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".csv", newline="", delete=False
+    ) as f:
+        write_rows(f, rows, "\n")
+    return f.name
+
+
+def concatenate(paths: List[str], f: Any, lineterminator: str = "\r\n") -> None:
+    # line i of every block is a piece of output row i
+    with ExitStack() as stack:
+        readers = [
+            csv.reader(stack.enter_context(open(p, "r", newline=""))) for p in paths
+        ]
+        rows = ([x for piece in pieces for x in piece] for pieces in zip(*readers))
+        write_rows(f, rows, lineterminator)
+
+
+def merge(paths: List[str], directory: str) -> List[str]:
+    # keep the number of blocks read at once below the open files limit
+    while len(paths) > MAX_OPEN_FILES:
+        merged = []
+        for i in range(0, len(paths), MAX_OPEN_FILES):
+            group = paths[i : i + MAX_OPEN_FILES]
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, suffix=".csv", newline="", delete=False
+            ) as f:
+                concatenate(group, f, "\n")
+            for p in group:
+                os.remove(p)
+            merged.append(f.name)
+        paths = merged
+    return paths
 
 
 def main():
@@ -45,18 +134,43 @@ def main():
     args = add_arguments(parser).parse_args()
     with read_from(args.source_file) as f:
         with output_to(args.output) as of:
-            csvrdr = csv.reader(
-                yield_or_write_rows_predicate(
-                    f, of, lambda x: not x.strip().startswith("#")
-                )
+            csvrdr = CommentedReader(
+                f, header=False, on_comment=lambda x: print(x, file=of, end="")
             )
-            data = []
-            csvwrt = csv.writer(of, dialect=csvrdr.dialect)
-            for row in csvrdr:
-                data.append(row)
-            colcount = len(data[0])
-            for ix in range(colcount):
-                csvwrt.writerow(r[ix] for r in data)
+            limit = args.memory << 20
+            with tempfile.TemporaryDirectory(dir=args.temp_dir) as tmp:
+                blocks = []
+                data: List[List[str]] = []
+                size = 0
+                count = 0
+                width = None
+                rows = iter(csvrdr)
+                for chunk in iter(lambda: list(islice(rows, BLOCK_ROWS)), []):
+                    if width is None:
+                        width = len(chunk[0])
+                    if min(map(len, chunk)) < width:
+                        ix = next(i for i, r in enumerate(chunk) if len(r) < width)
+                        raise AssertionError(
+                            "Row {} has {} fields, expected {}".format(
+                                count + ix + 1, len(chunk[ix]), width
+                            )
+                        )
+                    count += len(chunk)
+                    data.extend(chunk)
+                    size += sum(map(len, chain.from_iterable(chunk)))
+                    size += CELL_OVERHEAD * width * len(chunk)
+                    if size > limit:
+                        blocks.append(spill(transpose(data, width), tmp))
+                        data = []
+                        size = 0
+                if not blocks:
+                    if width is not None:
+                        write_rows(of, transpose(data, width))
+                    return
+                if data:
+                    blocks.append(spill(transpose(data, width), tmp))
+                del data
+                concatenate(merge(blocks, tmp), of)
 
 
 if __name__ == "__main__":
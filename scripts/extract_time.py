@@ -1,20 +1,41 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
 import sys
-from typing import Any, Dict, List, Optional, Sequence
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from commented_csv import CommentedReader, parse_line
+
+BLOCK_SIZE = 1 << 12
+
+Count = int
+Row = Dict[str, str]
 
 
 class store_count(argparse.Action):
     choices = ("first", "last")
     choices_str = "{{{}}}".format(",".join(choices))
     default = 0
-    metavar = "{} or COUNT".format(choices_str)
+    metavar = "{} or COUNT[,...]".format(choices_str)
 
     def __init__(self, option_strings: Sequence[str], **kwargs) -> None:
         super().__init__(option_strings, **kwargs)
 
+    @staticmethod
+    def parse(value: str) -> Count:
+        try:
+            intval = int(value)
+            if intval < 0:
+                raise OverflowError("count must be >= 0")
+            return intval
+        except ValueError:
+            if value not in store_count.choices:
+                raise ValueError(
+                    "choice {} not in {}".format(value, store_count.choices_str)
+                )
+            return 0 if value == store_count.choices[0] else -1
+
     def __call__(
         self,
         parser: argparse.ArgumentParser,
@@ -23,22 +44,12 @@ class store_count(argparse.Action):
         option_string,
     ) -> None:
         try:
-            try:
-                intval = int(values)
-                if intval < 0:
-                    raise OverflowError("count must be >= 0")
-                values = intval
-            except ValueError as err:
-                if values not in store_count.choices:
-                    raise ValueError(
-                        "choice {} not in {}".format(values, store_count.choices_str)
-                    )
-                value = store_count.choices[store_count.choices.index(values)]
-                if value == store_count.choices[0]:
-                    values = 0
-                elif value == store_count.choices[1]:
-                    values = -1
-            setattr(namespace, self.dest, values)
+            counts = [store_count.parse(x) for x in values.split(",")]
+            # the first COUNT given replaces the default, later ones add to it
+            previous = getattr(namespace, self.dest, None)
+            if isinstance(previous, list):
+                counts = previous + counts
+            setattr(namespace, self.dest, counts)
         except (
             OverflowError,
             ValueError,
@@ -48,8 +59,101 @@ class store_count(argparse.Action):
             raise argparse.ArgumentError(self, err.args[0] if err.args else "<empty>")
 
 
-def read_from(path: Optional[str]) -> Any:
-    return sys.stdin if not path else open(path, "r")
+class IndexedTimes:
+    """Timeprinter rows of a seekable file, found without reading it all.
+
+    The first row is read directly, the last by reading blocks backwards
+    from the end and a COUNT by bisecting byte offsets, which relies on
+    the count column never decreasing, as timeprinter writes it.
+    """
+
+    def __init__(self, f: Any) -> None:
+        self.f = f
+        self.size = f.seek(0, 2)
+        f.seek(0)
+        self.fieldnames: Optional[List[str]] = None
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            text = _data_line(line)
+            if text is not None:
+                self.fieldnames = parse_line(text)
+                break
+        self.data_start = f.tell()
+
+    def _row(self, text: str) -> Row:
+        return dict(zip(self.fieldnames or [], parse_line(text)))
+
+    def _row_from(self, offset: int) -> Optional[Tuple[int, Row]]:
+        # first data row starting at or after OFFSET, and where it starts
+        if offset > self.data_start:
+            # finish the line OFFSET is in, unless OFFSET starts one
+            self.f.seek(offset - 1)
+            self.f.readline()
+        else:
+            self.f.seek(self.data_start)
+        while True:
+            start = self.f.tell()
+            line = self.f.readline()
+            if not line:
+                return None
+            text = _data_line(line)
+            if text is not None:
+                return start, self._row(text)
+
+    def rows_from(self, offset: int) -> Iterator[Row]:
+        found = self._row_from(offset)
+        if found is None:
+            return
+        self.f.seek(found[0])
+        for line in iter(self.f.readline, b""):
+            text = _data_line(line)
+            if text is not None:
+                yield self._row(text)
+
+    def first(self) -> Optional[Row]:
+        found = self._row_from(self.data_start)
+        return found[1] if found is not None else None
+
+    def last(self) -> Optional[Row]:
+        end = self.size
+        partial = b""
+        while end > self.data_start:
+            start = max(self.data_start, end - BLOCK_SIZE)
+            self.f.seek(start)
+            lines = (self.f.read(end - start) + partial).split(b"\n")
+            # the first piece may be the end of a line starting further back
+            partial = lines[0] if start > self.data_start else b""
+            for line in reversed(lines[1:] if start > self.data_start else lines):
+                text = _data_line(line)
+                if text is not None:
+                    return self._row(text)
+            end = start
+        return None
+
+    def find(self, count: Count) -> List[Row]:
+        lo, hi = self.data_start, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = self._row_from(mid)
+            if found is None or int(get_count(found[1])) >= count:
+                hi = mid
+            else:
+                lo = mid + 1
+        rows = []
+        for row in self.rows_from(lo):
+            if int(get_count(row)) != count:
+                break
+            rows.append(row)
+        return rows
+
+
+def _data_line(line: bytes) -> Optional[str]:
+    stripped = line.strip()
+    if not stripped or stripped.startswith(b"#"):
+        return None
+    return stripped.decode()
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
@@ -65,7 +169,8 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         "-c",
         "--count",
         action=store_count,
-        help="extract time with count COUNT (default: {})".format(store_count.default),
+        help="extract time with count COUNT, comma-separated or repeated for "
+        "one line per COUNT (default: {})".format(store_count.default),
         required=False,
         default=store_count.default,
         metavar=store_count.metavar,
@@ -87,39 +192,78 @@ def get_time(row: Dict[str, str]) -> str:
     return ctime
 
 
-def main():
-    def not_empty_not_comment(f):
-        for r in f:
-            row = r.strip()
-            if row and not row.startswith("#"):
-                yield row
+def indexed_times(path: str, counts: List[Count]) -> Iterator[Union[str, Count]]:
+    with open(path, "rb") as f:
+        index = IndexedTimes(f)
+        if not index.fieldnames:
+            raise AssertionError("File has no fieldnames")
+        first = index.first()
+        if first is None:
+            raise AssertionError("File has no data rows")
+        for count in counts:
+            if count == 0:
+                yield get_time(first)
+            elif count == -1:
+                yield get_time(index.last() or first)
+            else:
+                rows = index.find(count)
+                yield from (get_time(r) for r in rows) if rows else (count,)
+
 
+def streamed_times(f: Any, counts: List[Count]) -> Iterator[Union[str, Count]]:
+    csvrdr = CommentedReader(f, strip=True)
+    if not csvrdr.fieldnames:
+        raise AssertionError("File has no fieldnames")
+    data = csvrdr.dicts()
+    first = next(data, None)
+    if first is None:
+        raise AssertionError("File has no data rows")
+    wanted = {c for c in counts if c > 0}
+    matches: Dict[Count, List[Row]] = {c: [] for c in wanted}
+    last = first
+    if wanted or -1 in counts:
+        # counts never decrease, so unless the last row is wanted the input
+        # is read only up to the highest COUNT
+        stop = None if -1 in counts else max(wanted)
+        for row in chain((first,), data):
+            last = row
+            if not wanted:
+                continue
+            count = int(get_count(row))
+            if count in matches:
+                matches[count].append(row)
+            elif stop is not None and count > stop:
+                break
+    for count in counts:
+        if count == 0:
+            yield get_time(first)
+        elif count == -1:
+            yield get_time(last)
+        else:
+            rows = matches[count]
+            yield from (get_time(r) for r in rows) if rows else (count,)
+
+
+def main():
     parser = argparse.ArgumentParser(
         description="Extract a timestamp from timeprinter output"
     )
     args = add_arguments(parser).parse_args()
-    with read_from(args.source_file) as f:
-        csvrdr = csv.DictReader(not_empty_not_comment(f))
-        if not csvrdr.fieldnames:
-            raise AssertionError("File has no fieldnames")
-        data: List = list(csvrdr)
-        if not data:
-            raise AssertionError("File has no data rows")
-        if args.count == -1 or args.count == 0:
-            print(get_time(data[args.count]))
+    counts = args.count if isinstance(args.count, list) else [args.count]
+    if args.source_file:
+        times = indexed_times(args.source_file, counts)
+    else:
+        times = streamed_times(sys.stdin, counts)
+    # a count that is not found comes back as itself
+    for time in times:
+        if isinstance(time, str):
+            print(time)
         else:
-            found = False
-            for row in data:
-                ccount = get_count(row)
-                if int(ccount) == args.count:
-                    found = True
-                    print(get_time(row))
-            if not found:
-                print(
-                    "{}: time with count {} not found".format(sys.argv[0], args.count),
-                    file=sys.stderr,
-                )
-                print(0)
+            print(
+                "{}: time with count {} not found".format(sys.argv[0], time),
+                file=sys.stderr,
+            )
+            print(0)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,8 @@ import argparse
 import sys
 from typing import Any, Optional
 
+from commented_csv import int_or_float
+
 
 def read_from(path: Optional[str]) -> Any:
     return sys.stdin if not path else open(path, "r")
@@ -22,12 +24,6 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
 
 
 def main():
-    def int_or_float(x: str):
-        try:
-            return int(x)
-        except ValueError:
-            return float(x)
-
     parser = argparse.ArgumentParser(
         description="Compute the delta from a list of numbers"
     )
@@ -3,8 +3,17 @@
 import argparse
 import sys
 import statistics as stat
+from itertools import chain, islice
 from typing import Any, Optional
 
+from commented_csv import SAMPLE_ROWS, ColumnTypes
+from streaming_stats import (
+    RunningStats,
+    parse_percentiles,
+    percentile,
+    percentile_label,
+)
+
 
 def read_from(path: Optional[str]) -> Any:
     return sys.stdin if not path else open(path, "r")
@@ -19,28 +28,56 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        action="store",
+        help="comma-separated percentiles to report, e.g. p50,p95,p99 (default: none)",
+        required=False,
+        type=parse_percentiles,
+        default=[],
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="compute in one pass and constant memory (median and percentiles are estimated)",
+        required=False,
+        default=False,
+    )
     return parser
 
 
 def main():
-    def int_or_float(x: str):
-        try:
-            return int(x)
-        except ValueError:
-            return float(x)
-
     parser = argparse.ArgumentParser(
         description="Output the statistics of a file with numbers as lines"
     )
     args = add_arguments(parser).parse_args()
     with read_from(args.source_file) as f:
-        data = [int_or_float(x) for x in f]
+        sample = list(islice(f, SAMPLE_ROWS))
+        convert = ColumnTypes.infer([[x] for x in sample], 1).numeric(0)
+        if args.streaming:
+            stats = RunningStats([50] + [p for p in args.percentiles if p != 50])
+            for x in chain(sample, f):
+                stats.add(convert(x))
+            if not stats.count:
+                raise AssertionError("File has no data")
+            print("mean", stats.mean)
+            print("median", stats.percentile(50))
+            print("mode", stats.mode)
+            print("stddev", stats.stdev)
+            print("variance", stats.variance)
+            for p in args.percentiles:
+                print(percentile_label(p), stats.percentile(p))
+            return
+        data = list(map(convert, chain(sample, f)))
         mean = stat.mean(data)
         print("mean", mean)
         print("median", stat.median(data))
         print("mode", stat.mode(data))
         print("stddev", stat.stdev(data))
         print("variance", stat.variance(data, xbar=mean))
+        for p in args.percentiles:
+            print(percentile_label(p), percentile(data, p))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import functools
+import glob
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from clock_align import ClockFit, fit_clock
+from commented_csv import CommentedReader
+from ground_truth_sensors_extract import FIELDNAMES, convert_bulk
+from profiler_loader import Profile, load_profile
+
+OUTPUT_FIELDS = [
+    "workload",
+    "window",
+    "group",
+    "section",
+    "execution",
+    "interval",
+    "start_ns",
+    "end_ns",
+    "duration_s",
+    "meter_energy_j",
+    "profiler_energy_j",
+    "abs_error_j",
+    "rel_error",
+    "power_rmse_w",
+    "samples",
+]
+CLOCK_FIELDS = ["clock_offset_ns", "clock_drift_ppm", "clock_r"]
+
+
+class Timeline(NamedTuple):
+    # cumulative profiler energy at every sample, continued across executions
+    times: np.ndarray
+    energy: np.ndarray
+    # sample intervals inside an execution (not the gaps between them)
+    measured: np.ndarray
+    executions: List[Tuple[Optional[str], Optional[str], int, int, int]]
+
+
+def output_to(path: Optional[str]) -> Any:
+    return sys.stdout if not path else open(path, "w")
+
+
+def log(*args: Any) -> None:
+    print("{}:".format(sys.argv[0]), *args, file=sys.stderr)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument(
+        "directories",
+        action="store",
+        help="workload directories, each with a .probe meter log, a "
+        ".profiler.json and optionally a .timeprinter.csv",
+        nargs="+",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        help="output file (default: stdout)",
+        required=False,
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--series",
+        action="store",
+        help="comma-separated profiler series summed over all devices "
+        "(default: %(default)s)",
+        required=False,
+        type=lambda x: x.split(","),
+        default="package,dram",
+    )
+    parser.add_argument(
+        "--windows",
+        action="store",
+        choices=("executions", "timeprinter", "all"),
+        help="compare over profiled executions, timeprinter intervals or both "
+        "(default: %(default)s)",
+        required=False,
+        default="all",
+    )
+    parser.add_argument(
+        "--offset-ns",
+        action="store",
+        help="nanoseconds added to the meter timestamps, or with --align the "
+        "expected offset, used as is when the fit is poor (default: 0)",
+        required=False,
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--align",
+        action="store_true",
+        help="estimate the meter's clock offset (and drift) from the "
+        "cross-correlation of both power signals and correct it",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--align-step-ns",
+        action="store",
+        help="bin width the power signals are resampled to (default: %(default)s)",
+        required=False,
+        type=int,
+        default=100_000_000,
+    )
+    parser.add_argument(
+        "--max-lag-ns",
+        action="store",
+        help="search offsets within this distance of --offset-ns, 0 for any "
+        "(default: %(default)s)",
+        required=False,
+        type=int,
+        default=5_000_000_000,
+    )
+    parser.add_argument(
+        "--min-correlation",
+        action="store",
+        help="keep --offset-ns instead of fits correlating less than this "
+        "(default: %(default)s)",
+        required=False,
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--max-drift-ppm",
+        action="store",
+        help="also search clock drifts up to this rate (default: offset only)",
+        required=False,
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--drift-steps",
+        action="store",
+        help="number of drifts tried within +/- --max-drift-ppm (default: %(default)s)",
+        required=False,
+        type=int,
+        default=21,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        help="number of worker processes for many directories (default: CPU count)",
+        required=False,
+        type=int,
+        default=None,
+    )
+    return parser
+
+
+def find_file(directory: str, suffix: str, required: bool = True) -> Optional[str]:
+    paths = glob.glob(os.path.join(glob.escape(directory), "*" + suffix))
+    if len(paths) > 1:
+        raise AssertionError("{}: more than one *{} file".format(directory, suffix))
+    if not paths:
+        if required:
+            raise AssertionError("{}: no *{} file".format(directory, suffix))
+        return None
+    return paths[0]
+
+
+def load_meter(path: str, offset_ns: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    with open(path, "r") as f:
+        table = convert_bulk(f)
+    times = table[:, FIELDNAMES.index("localtime_avg_ns")].astype(np.int64)
+    power = table[:, FIELDNAMES.index("power_watt")].astype(np.float64)
+    steps = np.diff(times)
+    if np.any(steps < 0):
+        raise AssertionError("{}: meter timestamps must not decrease".format(path))
+    keep = np.concatenate(([True], steps > 0))
+    if not keep.all():
+        log("{}: dropped {} repeated timestamps".format(path, (~keep).sum()))
+    if keep.sum() < 2:
+        raise AssertionError("{}: meter has fewer than 2 samples".format(path))
+    return times[keep] + offset_ns, power[keep]
+
+
+def cumulative_energy(times: np.ndarray, power: np.ndarray) -> np.ndarray:
+    seconds = np.diff(times) * 1e-9
+    return np.concatenate(([0.0], np.cumsum((power[1:] + power[:-1]) / 2 * seconds)))
+
+
+def meter_energy(times: np.ndarray, power: np.ndarray, at: np.ndarray) -> np.ndarray:
+    # integral of the linearly interpolated power from the first sample to
+    # each time in AT (clamped to the meter's range), via an as-of lookup of
+    # the sample at or before it
+    acc = cumulative_energy(times, power)
+    at = np.clip(at, times[0], times[-1])
+    k = np.clip(np.searchsorted(times, at, side="right") - 1, 0, len(times) - 2)
+    frac = (at - times[k]) / (times[k + 1] - times[k])
+    p_at = power[k] + frac * (power[k + 1] - power[k])
+    return acc[k] + (at - times[k]) * 1e-9 * (power[k] + p_at) / 2
+
+
+def profiler_timeline(profile: Profile, series: List[str]) -> Timeline:
+    times, energy, measured, executions = [], [], [], []
+    total = 0.0
+    start = 0
+    for g in profile.groups:
+        for s in g.sections:
+            for idx, e in enumerate(s.executions, start=1):
+                if e.samples < 2:
+                    continue
+                readings = np.zeros(e.samples)
+                for device in e.cpu + e.gpu:
+                    for name in series:
+                        if name in device.series:
+                            values = device.series[name]
+                            readings += values.reshape(e.samples, -1).sum(axis=1)
+                times.append(e.sample_times.astype(np.int64))
+                energy.append(total + readings - readings[0])
+                total = energy[-1][-1]
+                # the interval into this execution comes from the previous one
+                gap = np.ones(e.samples, dtype=bool)
+                gap[-1] = False
+                measured.append(gap)
+                executions.append((g.label, s.label, idx, start, start + e.samples))
+                start += e.samples
+    if not times:
+        raise AssertionError("Profile has no executions with 2 or more samples")
+    order = np.concatenate(times)
+    if np.any(np.diff(order) < 0):
+        raise AssertionError("Executions must not overlap in time")
+    return Timeline(
+        order,
+        np.concatenate(energy),
+        np.concatenate(measured)[:-1],
+        executions,
+    )
+
+
+def timeprinter_times(path: str) -> np.ndarray:
+    with open(path, "r") as f:
+        reader = CommentedReader(f)
+        return reader.arrays(["time"])["time"].astype(np.int64)
+
+
+def window_metrics(
+    timeline: Timeline,
+    meter: Tuple[np.ndarray, np.ndarray],
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    m_times, m_power = meter
+    # windows only cover the part of the run the meter saw
+    starts = np.maximum(starts, max(m_times[0], timeline.times[0]))
+    ends = np.minimum(ends, min(m_times[-1], timeline.times[-1]))
+    ends = np.maximum(ends, starts)
+    bounds = np.concatenate((starts, ends))
+    m_energy = meter_energy(m_times, m_power, bounds)
+    p_energy = np.interp(bounds, timeline.times, timeline.energy)
+    n = len(starts)
+    meter_j = m_energy[n:] - m_energy[:n]
+    profiler_j = p_energy[n:] - p_energy[:n]
+
+    # power of each profiler sample interval against the meter's average
+    # power over the same interval
+    t = timeline.times
+    seconds = np.diff(t) * 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_power = np.diff(timeline.energy) / seconds
+        m_power_avg = np.diff(meter_energy(m_times, m_power, t)) / seconds
+    valid = timeline.measured & (seconds > 0)
+    valid &= (t[:-1] >= m_times[0]) & (t[1:] <= m_times[-1])
+    squares = np.where(valid, (p_power - m_power_avg) ** 2, 0.0)
+    acc_sq = np.concatenate(([0.0], np.cumsum(squares)))
+    acc_n = np.concatenate(([0], np.cumsum(valid)))
+    # intervals lying entirely inside each window
+    first = np.searchsorted(t[:-1], starts, side="left")
+    last = np.searchsorted(t[1:], ends, side="right")
+    last = np.maximum(last, first)
+    samples = acc_n[last] - acc_n[first]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rmse = np.sqrt((acc_sq[last] - acc_sq[first]) / samples)
+        rel_error = (profiler_j - meter_j) / meter_j
+    return {
+        "start_ns": starts,
+        "end_ns": ends,
+        "duration_s": (ends - starts) * 1e-9,
+        "meter_energy_j": meter_j,
+        "profiler_energy_j": profiler_j,
+        "abs_error_j": np.abs(profiler_j - meter_j),
+        "rel_error": rel_error,
+        "power_rmse_w": rmse,
+        "samples": samples,
+    }
+
+
+def align(
+    times: np.ndarray, power: np.ndarray, timeline: Timeline, args: argparse.Namespace
+) -> ClockFit:
+    spans = [
+        (timeline.times[x], timeline.times[y - 1]) for *_, x, y in timeline.executions
+    ]
+    return fit_clock(
+        (times, cumulative_energy(times, power)),
+        (timeline.times, timeline.energy),
+        args.align_step_ns,
+        spans,
+        max_lag=args.max_lag_ns or None,
+        guess=args.offset_ns,
+        max_drift_ppm=args.max_drift_ppm,
+        drift_steps=args.drift_steps,
+    )
+
+
+def compare_directory(directory: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    workload = os.path.basename(os.path.normpath(directory))
+    with open(find_file(directory, ".profiler.json"), "r") as f:
+        timeline = profiler_timeline(load_profile(f), args.series)
+    clock: Dict[str, Any] = {}
+    if args.align:
+        m_times, m_power = load_meter(find_file(directory, ".probe"))
+        fit = align(m_times, m_power, timeline, args)
+        if not fit.correlation >= args.min_correlation:
+            log(
+                "{}: clock fit correlates {:.3f}, keeping --offset-ns".format(
+                    directory, fit.correlation
+                )
+            )
+            fit = ClockFit(fit.origin_ns, args.offset_ns, 0.0, fit.correlation)
+        meter = (fit.apply(m_times), m_power)
+        clock = {
+            "clock_offset_ns": fit.offset_ns,
+            "clock_drift_ppm": fit.drift_ppm,
+            "clock_r": fit.correlation,
+        }
+    else:
+        meter = load_meter(find_file(directory, ".probe"), args.offset_ns)
+
+    labels: List[Dict[str, Any]] = []
+    starts, ends = [], []
+    if args.windows in ("executions", "all"):
+        for group, section, idx, first, last in timeline.executions:
+            labels.append(
+                {
+                    "window": "execution",
+                    "group": group,
+                    "section": section,
+                    "execution": idx,
+                }
+            )
+            starts.append(timeline.times[first])
+            ends.append(timeline.times[last - 1])
+    timeprinter = find_file(directory, ".timeprinter.csv", required=False)
+    if timeprinter is not None and args.windows in ("timeprinter", "all"):
+        marks = timeprinter_times(timeprinter)
+        for ix in range(len(marks) - 1):
+            labels.append({"window": "timeprinter", "interval": ix})
+        starts.extend(marks[:-1])
+        ends.extend(marks[1:])
+    if not labels:
+        return []
+    metrics = window_metrics(
+        timeline, meter, np.array(starts, dtype=np.int64), np.array(ends, np.int64)
+    )
+    # windows the clamping to the meter/profiler overlap left empty
+    outside = metrics["end_ns"] <= metrics["start_ns"]
+    if outside.any():
+        log(
+            "{}: skipped {} windows outside the meter and profiler overlap".format(
+                directory, int(outside.sum())
+            )
+        )
+    columns = {k: v.tolist() for k, v in metrics.items()}
+    return [
+        _blank_nan(
+            dict(
+                label,
+                workload=workload,
+                **clock,
+                **{k: v[i] for k, v in columns.items()},
+            )
+        )
+        for i, label in enumerate(labels)
+        if not outside[i]
+    ]
+
+
+def _blank_nan(row: Dict[str, Any]) -> Dict[str, Any]:
+    # undefined metrics (no sample inside a window, no meter energy) are
+    # written as empty cells, which csv_field_stats skips, not as nan
+    return {
+        k: None if isinstance(v, float) and math.isnan(v) else v for k, v in row.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the energy measured by an external meter with the "
+        "energy profiler's over the same time windows"
+    )
+    args = add_arguments(parser).parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be >= 1")
+    if args.align_step_ns < 1:
+        parser.error("--align-step-ns must be >= 1")
+    if args.max_lag_ns < 0:
+        parser.error("--max-lag-ns must be >= 0")
+    if args.max_drift_ppm < 0 or args.drift_steps < 1:
+        parser.error("--max-drift-ppm must be >= 0 and --drift-steps >= 1")
+    if len(args.directories) == 1:
+        results = [compare_directory(args.directories[0], args)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(
+                executor.map(
+                    functools.partial(compare_directory, args=args), args.directories
+                )
+            )
+    with output_to(args.output) as of:
+        fieldnames = OUTPUT_FIELDS + (CLOCK_FIELDS if args.align else [])
+        writer = csv.DictWriter(of, fieldnames, restval="")
+        writer.writeheader()
+        for rows in results:
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
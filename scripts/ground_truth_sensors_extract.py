@@ -3,7 +3,28 @@
 import argparse
 import csv
 import sys
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from commented_csv import CommentedReader, data_lines
+
+FIELDNAMES = [
+    "count",
+    "index",
+    "current",
+    "voltage",
+    "power_watt",
+    "energy_kwh",
+    "energy_joule_from_kwh",
+    "energy_joule",
+    "energy_joule_acc",
+    "errcode",
+    "localtime_ini",
+    "localtime_ini_ns",
+    "localtime_fin",
+    "localtime_fin_ns",
+    "localtime_avg",
+    "localtime_avg_ns",
+]
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -36,6 +57,13 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="read the whole file into arrays and convert it at once (requires numpy)",
+        required=False,
+        default=False,
+    )
     return parser
 
 
@@ -89,7 +117,9 @@ def generate_first_row(row: Dict[str, str]) -> Tuple[float, Dict[str, Any]]:
     }
 
 
-def generate_first_row_no_err(reader: csv.DictReader) -> Tuple[float, Dict[str, Any]]:
+def generate_first_row_no_err(
+    reader: Iterator[Dict[str, str]],
+) -> Tuple[float, Dict[str, Any]]:
     for raw in reader:
         val = generate_first_row(raw)
         if val is not None:
@@ -140,7 +170,7 @@ def generate_next_row(
 
 
 def generate_next_rows_no_err(
-    reader: csv.DictReader,
+    reader: Iterator[Dict[str, str]],
     writer: csv.DictWriter,
     prev_row: Dict[str, Any],
     first_kwh: float,
@@ -152,13 +182,84 @@ def generate_next_rows_no_err(
             writer.writerow(prev_row)
 
 
+def convert_bulk(f: Any) -> Any:
+    import numpy as np
+
+    lines = list(data_lines(f, comment=None, strip=True))
+    if len(lines) < 2:
+        raise AssertionError("No data rows without error found")
+    header = lines[0].split(";")
+    # one split over the whole file instead of one dict per line
+    cells = np.array(";".join(lines[1:]).split(";"), dtype=object)
+    if len(cells) != (len(lines) - 1) * len(header):
+        raise AssertionError("Rows must have {} fields".format(len(header)))
+    cells = cells.reshape(len(lines) - 1, len(header))
+
+    def column(name: str, dtype: Any = np.float64) -> Any:
+        if name not in header:
+            raise AssertionError("{} is not a valid fieldname".format(name))
+        return cells[:, header.index(name)].astype(dtype)
+
+    index = column("#index", np.int64)
+    errcode = column("err_code")
+    failed = errcode != 0
+    for idx, err in zip(index[failed].tolist(), errcode[failed].tolist()):
+        log("Row with index {} with non-zero error code {}".format(idx, err))
+    valid = ~failed
+    if not valid.any():
+        raise AssertionError("No data rows without error found")
+
+    power = column("power")[valid]
+    total = column("total")[valid]
+    ini = column("localtime_ini")[valid]
+    fin = column("localtime_fin")[valid]
+    avg = (ini + fin) / 2
+    # trapezoids between consecutive valid rows, as integrate_energy
+    energy = np.zeros(len(power))
+    energy[1:] = ((power[:-1] + power[1:]) / 2) * np.diff(avg)
+    kwh = total - total[0]
+
+    table = np.empty((len(power), len(FIELDNAMES)), dtype=object)
+    for ix, values in enumerate(
+        (
+            np.arange(len(power)),
+            index[valid],
+            column("current")[valid],
+            column("voltage")[valid],
+            power,
+            kwh,
+            kwh2joule(kwh),
+            energy,
+            np.cumsum(energy),
+            errcode[valid],
+            ini,
+            (ini * 1e9).astype(np.int64),
+            fin,
+            (fin * 1e9).astype(np.int64),
+            avg,
+            (avg * 1e9).astype(np.int64),
+        )
+    ):
+        table[:, ix] = values
+    return table
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Extract useful columns and convert units if necessary"
     )
     args = add_arguments(parser).parse_args()
+    if args.bulk:
+        with read_from(args.source_file) as f:
+            table = convert_bulk(f)
+        with output_to(args.output) as of:
+            writer = csv.writer(of)
+            writer.writerow(FIELDNAMES)
+            writer.writerows(table.tolist())
+        return
     with read_from(args.source_file) as f:
-        reader = csv.DictReader(f, delimiter=";")
+        # the header itself starts with '#' ("#index;..."), so no comment lines
+        reader = CommentedReader(f, delimiter=";", comment=None).dicts()
         kwh, prev_row = generate_first_row_no_err(reader)
         with output_to(args.output) as of:
             writer = csv.DictWriter(of, prev_row, delimiter=",")
@@ -0,0 +1,30 @@
+"""Experiment parameters encoded in result paths.
+
+Output files are named after the run that produced them, e.g.
+1000/output.dgemm.out.dgemm_4096.0x3f.2.perf.csv: the sampling interval
+directory, the function, problem sizes, CPU mask and repetition (or
+thread count). DEFAULT_PATTERN names these as regular expression groups
+and parameters() returns the ones a path matches.
+"""
+
+import os
+import re
+from typing import Dict
+
+# the interval directory matches even when the file name does not; sizes
+# may hold dots (rng_rng.out.20000000000_0.0_1.0) and some programs have
+# no function (sleep_sleep.out.5)
+DEFAULT_PATTERN = (
+    r"(?:(?P<interval>\d+)/)?"
+    r"(?:output\.[^/]+?\.out\.(?:(?P<function>[a-z][^_./]*)_)?(?P<sizes>[\w.]+?)"
+    r"(?:\.(?!none\.)[a-z]+)?(?:\.(?P<mask>0x[0-9a-fA-F]+|none))?"
+    r"(?:\.(?:(?P<repetition>\d+)|(?P<threads>\d+)t))?(?=(?:\.[a-z]+)+$))?"
+    r"[^/]*$"
+)
+
+
+def parameters(path: str, pattern: "re.Pattern") -> Dict[str, str]:
+    m = pattern.search(path.replace(os.sep, "/"))
+    if m is None:
+        return {}
+    return {k: v for k, v in m.groupdict().items() if v is not None}
@@ -3,7 +3,23 @@
 import sys
 import csv
 import argparse
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import io
+import os
+import shutil
+import tempfile
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from commented_csv import CommentedReader, data_lines, int_or_float, parse_line
 
 
 def log(*args: Any) -> None:
@@ -18,6 +34,34 @@ def output_to(path: Optional[str]) -> Any:
     return sys.stdout if not path else open(path, "w")
 
 
+def seekable_source(path: Optional[str]) -> BinaryIO:
+    if path:
+        return open(path, "rb")
+    # pipes cannot be rewound, spool them to disk instead of memory
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(sys.stdin.buffer, spool)
+    spool.seek(0)
+    return spool
+
+
+def last_data_line(f: BinaryIO, block_size: int = 1 << 16) -> Optional[str]:
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    partial = b""
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + partial).split(b"\n")
+        # the first piece may be the tail of a line that starts in an earlier block
+        partial = lines.pop(0) if pos > 0 else b""
+        for line in reversed(lines):
+            row = line.decode().strip()
+            if row and not row.startswith("#"):
+                return row
+    return None
+
+
 def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     def positive_int_or_float(s: str) -> Union[int, float]:
         try:
@@ -70,6 +114,14 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=positive_int_or_float,
         default=0,
     )
+    parser.add_argument(
+        "-b",
+        "--bulk",
+        action="store_true",
+        help="read the whole file into arrays and convert it at once (requires numpy)",
+        required=False,
+        default=False,
+    )
     return parser
 
 
@@ -78,20 +130,8 @@ def main():
     FieldNamesData = Dict[str, Tuple[int, int, Any, Callable]]
     SampleRows = List[List[str]]
 
-    def not_empty_not_comment(f):
-        for r in f:
-            row = r.strip()
-            if row and not row.startswith("#"):
-                yield row
-
-    def int_or_float(s: str):
-        try:
-            return int(s)
-        except ValueError:
-            return float(s)
-
     def all_rows_of_sample(
-        first_row: List[str], csvrdr: csv.reader
+        first_row: List[str], csvrdr: Iterator[List[str]]
     ) -> Tuple[SampleRows, List[str]]:
         sample_rows = [first_row]
         iterator = iter(csvrdr)
@@ -150,6 +190,48 @@ def main():
             row[ix] if ix != time_ix else row[ix] - shift_by for ix in range(len(row))
         )
 
+    def convert_bulk(lines: List[str], start: int):
+        import numpy as np
+
+        if not lines:
+            return None, None
+        columns = lines[0].count(",") + 1
+        if columns < 6:
+            raise AssertionError("Rows must have at least 6 columns")
+        # one split over the whole file instead of one csv row per line
+        cells = np.array(",".join(lines).split(","), dtype=object)
+        if len(cells) != len(lines) * columns:
+            raise AssertionError("Rows must have the same number of columns")
+        cells = cells.reshape(len(lines), columns)
+        times = cells[:, 0]
+        events_per_sample = int(np.argmax(times != times[0])) or len(times)
+        if len(times) % events_per_sample:
+            raise AssertionError("Samples must have the same number of events")
+        samples = cells.reshape(-1, events_per_sample, columns)
+        if (
+            not (samples[:, :, 0] == samples[:, :1, 0]).all()
+            or not (samples[:, :, 3] == samples[0, :, 3]).all()
+        ):
+            raise AssertionError("Samples must have the same events in the same order")
+
+        fieldnames = ["count", "time"]
+        for event_name in samples[0, :, 3]:
+            fieldnames.append(event_name)
+            fieldnames.append("{}-counter_run_time".format(event_name))
+            fieldnames.append("{}-counter_run_percent".format(event_name))
+
+        table = np.empty((len(samples) + 1, len(fieldnames)), dtype=object)
+        table[0] = [0, start] + [0.0, 0, 0.0] * events_per_sample
+        table[1:, 0] = range(1, len(samples) + 1)
+        table[1:, 1] = (
+            (samples[:, 0, 0].astype(np.float64) * 1e9).astype(np.int64) + start
+        ).tolist()
+        # empty cells are written as 0, like in convert_sample_rows
+        values = samples[:, :, [1, 4, 5]]
+        values[values == ""] = 0
+        table[1:, 2:] = values.reshape(len(samples), -1)
+        return fieldnames, table
+
     parser = argparse.ArgumentParser(
         description="Convert perf stat output to a more plottable format"
     )
@@ -158,48 +240,86 @@ def main():
         raise parser.error("-e/--end must be greater than -s/--start")
     if args.end and not args.start:
         raise parser.error("-e/--end requires -s/--start")
-    with read_from(args.source_file) as f:
-        csvrdr = csv.reader(not_empty_not_comment(f))
-        first_row = next(iter(csvrdr), None)
+    units_meta = ["#units", "energy=J", "power=W", "time=ns"]
+    if args.bulk:
+        with read_from(args.source_file) as f:
+            fieldnames, table = convert_bulk(
+                list(data_lines(f, strip=True)), args.start
+            )
+        if table is None:
+            return
+        with output_to(args.output) as of:
+            writer = csv.writer(of)
+            writer.writerow(units_meta)
+            writer.writerow(fieldnames)
+            if args.end:
+                last_time = table[-1, 1]
+                if last_time > args.end:
+                    shift_by = last_time - args.end
+                    log("perf overhead ~", shift_by, "ns")
+                    log("shifting time values left by", shift_by, "ns")
+                    table[:, 1] -= shift_by
+                else:
+                    log("provided end time >= {}".format(last_time))
+            writer.writerows(table.tolist())
+        return
+    with seekable_source(args.source_file) if args.end else read_from(
+        args.source_file
+    ) as source:
+        shift_by = 0
+        last_line = None
+        if args.end:
+            # find the last timestamp up front so rows can be shifted as they stream
+            last_line = last_data_line(source)
+            source.seek(0)
+            f = io.TextIOWrapper(source)
+        else:
+            f = source
+        csvrdr = iter(CommentedReader(f, header=False, strip=True))
+        first_row = next(csvrdr, None)
         if first_row:
-            units_meta = ["#units", "energy=J", "power=W", "time=ns"]
             sample_rows, next_row = all_rows_of_sample(first_row, csvrdr)
             fieldnames = generate_field_names(sample_rows, start=args.start)
             first_data_row = [0, args.start] + ([0.0, 0, 0.0] * len(sample_rows))
             assert len(first_data_row) == len(fieldnames)
+            time_ix = fieldnames["time"][0]
+            if last_line is not None:
+                last_time = fieldnames["time"][3](parse_line(last_line)[0])
+                if last_time > args.end:
+                    shift_by = last_time - args.end
+                    log("perf overhead ~", shift_by, "ns")
+                    log("shifting time values left by", shift_by, "ns")
+                else:
+                    log("provided end time >= {}".format(last_time))
             with output_to(args.output) as of:
                 writer = csv.writer(of)
                 writer.writerow(units_meta)
                 writer.writerow(fieldnames)
 
-                if not args.end:
+                if not shift_by:
                     writer.writerow(first_data_row)
                     writer.writerow(convert_sample_rows(sample_rows, fieldnames))
                     while next_row is not None:
                         sample_rows, next_row = all_rows_of_sample(next_row, csvrdr)
                         writer.writerow(convert_sample_rows(sample_rows, fieldnames))
                 else:
-                    data = [first_data_row]
-                    data.append(
-                        [x for x in convert_sample_rows(sample_rows, fieldnames)]
+                    writer.writerow(shift_row_time(first_data_row, shift_by, time_ix))
+                    writer.writerow(
+                        shift_row_time(
+                            list(convert_sample_rows(sample_rows, fieldnames)),
+                            shift_by,
+                            time_ix,
+                        )
                     )
                     while next_row is not None:
                         sample_rows, next_row = all_rows_of_sample(next_row, csvrdr)
-                        data.append(
-                            [x for x in convert_sample_rows(sample_rows, fieldnames)]
+                        writer.writerow(
+                            shift_row_time(
+                                list(convert_sample_rows(sample_rows, fieldnames)),
+                                shift_by,
+                                time_ix,
+                            )
                         )
-                    time_ix = fieldnames["time"][0]
-                    last_time = data[-1][time_ix]
-                    if last_time > args.end:
-                        shift_by = last_time - args.end
-                        log("perf overhead ~", shift_by, "ns")
-                        log("shifting time values left by", shift_by, "ns")
-                        for row in data:
-                            writer.writerow(shift_row_time(row, shift_by, time_ix))
-                    else:
-                        log("provided end time >= {}".format(last_time))
-                        for row in data:
-                            writer.writerow(row)
 
 
 if __name__ == "__main__":
@@ -2,10 +2,12 @@
 
 import sys
 import re
-import copy
 import csv
 import argparse
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from collections import deque
+from typing import Any, Iterable, List, Optional, Tuple, Union
+
+from commented_csv import ColumnTypes, CommentedReader
 
 
 def log(*args: Any) -> None:
@@ -38,75 +40,218 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+
+    def positive_int(x: str) -> int:
+        val = int(x)
+        if val <= 0:
+            raise argparse.ArgumentTypeError("value must be positive")
+        return val
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "-n",
+        "--numpy",
+        action="store_true",
+        help="compute the power of all intervals at once (requires numpy)",
+        required=False,
+        default=False,
+    )
+    mode.add_argument(
+        "-w",
+        "--window",
+        action="store",
+        help="average power over a rolling window of NS nanoseconds",
+        required=False,
+        type=positive_int,
+        default=None,
+        metavar="NS",
+    )
+    mode.add_argument(
+        "-r",
+        "--resample",
+        action="store",
+        help="average power over consecutive buckets of NS nanoseconds",
+        required=False,
+        type=positive_int,
+        default=None,
+        metavar="NS",
+    )
     return parser
 
 
-def main():
-    def not_empty_row(f):
-        for r in f:
-            row = r.strip()
-            if row:
-                yield row
-
-    def int_or_float(s: str):
-        try:
-            return int(s)
-        except ValueError:
-            return float(s)
-
-    def new_fieldnames(fieldnames: List[str], pattern_exprs: Tuple[str]) -> List[str]:
-        converted = []
-        for f in fieldnames:
-            for p in pattern_exprs:
-                if re.compile(p).match(f) is not None:
-                    converted.append(f)
-                    break
-        return converted
-
-    def filtered_fieldnames(row: List[str], fieldnames: List[str]) -> Dict[str, str]:
-        return {k: v for (k, v) in row.items() if k in fieldnames}
+ENERGY_PATTERN = re.compile(r"^power/energy-.+/$")
+
+
+class ColumnPlan:
+    def __init__(
+        self,
+        fieldnames: List[str],
+        patterns: Tuple[str, ...],
+        types: Optional[ColumnTypes] = None,
+    ) -> None:
+        progs = [re.compile(p) for p in patterns]
+        self.kept = [
+            ix for ix, f in enumerate(fieldnames) if any(p.match(f) for p in progs)
+        ]
+        self.fieldnames = [fieldnames[ix] for ix in self.kept]
+        self.count_ix = fieldnames.index("count")
+        self.time_ix = fieldnames.index("time")
+        self.energy_ixs = [
+            ix for ix in self.kept if ENERGY_PATTERN.match(fieldnames[ix]) is not None
+        ]
+        # position in the output row of every kept input column
+        self.out_count = self.kept.index(self.count_ix)
+        self.out_time = self.kept.index(self.time_ix)
+        self.out_energy = [self.kept.index(ix) for ix in self.energy_ixs]
+        self.types = types or ColumnTypes([])
+        self.to_time = self.types.numeric(self.time_ix)
+        self.to_energy = [self.types.numeric(ix) for ix in self.energy_ixs]
 
+
+def yield_power_rows(plan: ColumnPlan, first_row: List[str], rows: Iterable[List[str]]):
+    width = len(plan.kept)
+    time_prev = plan.to_time(first_row[plan.time_ix])
+    for row in rows:
+        time_current = plan.to_time(row[plan.time_ix])
+        delta = (time_current - time_prev) * 1e-9
+        new_row = [None] * width
+        new_row[plan.out_count] = row[plan.count_ix]
+        new_row[plan.out_time] = (time_current + time_prev) // 2
+        for out_ix, ix, convert in zip(
+            plan.out_energy, plan.energy_ixs, plan.to_energy
+        ):
+            new_row[out_ix] = convert(row[ix]) / delta
+        yield new_row
+        time_prev = time_current
+
+
+def yield_intervals(plan: ColumnPlan, first_row: List[str], rows: Iterable[List[str]]):
+    time_prev = plan.to_time(first_row[plan.time_ix])
+    for row in rows:
+        time_current = plan.to_time(row[plan.time_ix])
+        energy = [c(row[ix]) for c, ix in zip(plan.to_energy, plan.energy_ixs)]
+        yield row[plan.count_ix], time_prev, time_current, energy
+        time_prev = time_current
+
+
+def make_power_row(
+    plan: ColumnPlan,
+    count: Any,
+    time: Union[int, float],
+    energy: List[float],
+    duration: Union[int, float],
+) -> List[Any]:
+    new_row = [None] * len(plan.kept)
+    new_row[plan.out_count] = count
+    new_row[plan.out_time] = time
+    seconds = duration * 1e-9
+    for out_ix, e in zip(plan.out_energy, energy):
+        new_row[out_ix] = e / seconds
+    return new_row
+
+
+def yield_rolling_power_rows(
+    plan: ColumnPlan, first_row: List[str], rows: Iterable[List[str]], window: int
+):
+    # running energy sums over the intervals that end inside the window
+    intervals = deque()
+    sums = [0.0] * len(plan.energy_ixs)
+    for count, begin, end, energy in yield_intervals(plan, first_row, rows):
+        intervals.append((begin, end, energy))
+        sums = [s + e for s, e in zip(sums, energy)]
+        while intervals[0][1] <= end - window:
+            _, _, old = intervals.popleft()
+            sums = [s - e for s, e in zip(sums, old)]
+        if len(intervals) == 1:
+            # drop the rounding error accumulated by the subtractions
+            sums = list(energy)
+        start = intervals[0][0]
+        yield make_power_row(plan, count, (start + end) // 2, sums, end - start)
+
+
+def yield_resampled_power_rows(
+    plan: ColumnPlan, first_row: List[str], rows: Iterable[List[str]], period: int
+):
+    # interval energy is spread uniformly over time and split at bucket boundaries
+    origin = plan.to_time(first_row[plan.time_ix])
+    bucket = 0
+    sums = [0.0] * len(plan.energy_ixs)
+    covered = 0
+    for _, start, end, energy in yield_intervals(plan, first_row, rows):
+        duration = end - start
+        if duration <= 0:
+            continue
+        while start < end:
+            bucket_start = origin + bucket * period
+            stop = min(end, bucket_start + period)
+            fraction = (stop - start) / duration
+            sums = [s + e * fraction for s, e in zip(sums, energy)]
+            covered += stop - start
+            start = stop
+            if stop == bucket_start + period:
+                bucket += 1
+                yield make_power_row(
+                    plan, bucket, bucket_start + period // 2, sums, covered
+                )
+                sums = [0.0] * len(plan.energy_ixs)
+                covered = 0
+    if covered:
+        bucket_start = origin + bucket * period
+        yield make_power_row(
+            plan, bucket + 1, bucket_start + covered // 2, sums, covered
+        )
+
+
+def compute_power_rows(plan: ColumnPlan, first_row: List[str], rows: List[List[str]]):
+    import numpy as np
+
+    if not rows:
+        return []
+    cells = np.array([first_row] + rows, dtype=object)
+    times = plan.types.array(plan.time_ix, cells[:, plan.time_ix].tolist())
+    energy = cells[1:, plan.energy_ixs].astype(np.float64)
+    deltas = np.diff(times)
+    table = np.empty((len(rows), len(plan.kept)), dtype=object)
+    table[:, plan.out_count] = cells[1:, plan.count_ix]
+    table[:, plan.out_time] = ((times[1:] + times[:-1]) // 2).tolist()
+    table[:, plan.out_energy] = (energy / (deltas * 1e-9)[:, np.newaxis]).tolist()
+    return table.tolist()
+
+
+def main():
     parser = argparse.ArgumentParser(
         description="Convert perf stat output to a more plottable format"
     )
     args = add_arguments(parser).parse_args()
-    patterns = (r"^count$", r"^time$", r"^power/energy-.+/$")
+    patterns = (r"^count$", r"^time$", ENERGY_PATTERN.pattern)
     with read_from(args.source_file) as f:
         with output_to(args.output) as of:
-            fieldnames = None
-            for row in f:
-                if row.startswith("#"):
-                    print(row, file=of, end="")
-                else:
-                    fieldnames = row
-                    break
-            assert fieldnames is not None
-            fieldnames = csv.DictReader((fieldnames,)).fieldnames
-            csvrdr = csv.DictReader(not_empty_row(f), fieldnames)
-            fieldnames = new_fieldnames(csvrdr.fieldnames, patterns)
-            writer = csv.DictWriter(of, fieldnames)
-            writer.writeheader()
-            first_row = next(iter(csvrdr))
+            reader = CommentedReader(
+                f, strip=True, on_comment=lambda x: print(x, file=of, end="")
+            )
+            for line in reader.meta_lines:
+                print(line, file=of, end="")
+            assert reader.fieldnames is not None
+            plan = ColumnPlan(reader.fieldnames, patterns, reader.infer_types())
+            csvrdr = iter(reader)
+            writer = csv.writer(of)
+            writer.writerow(plan.fieldnames)
+            first_row = next(csvrdr, None)
             if first_row is None:
                 raise AssertionError("No data rows present")
-            writer.writerow(filtered_fieldnames(first_row, writer.fieldnames))
-
-            prev_row = first_row
-            for row in csvrdr:
-                time_current = int_or_float(row["time"])
-                time_prev = int_or_float(prev_row["time"])
-                new_row = {}
-                new_row["count"] = row["count"]
-                new_row["time"] = (time_current + time_prev) // 2
-                for k, e_curr in (
-                    (k, int_or_float(v))
-                    for (k, v) in row.items()
-                    if re.compile(r"^power/energy-.+/$").match(k)
-                ):
-                    delta = (time_current - time_prev) * 1e-9
-                    new_row[k] = e_curr / delta
-                writer.writerow(new_row)
-                prev_row = row
+            writer.writerow([first_row[ix] for ix in plan.kept])
+            if args.numpy:
+                writer.writerows(compute_power_rows(plan, first_row, list(csvrdr)))
+            elif args.window:
+                writer.writerows(
+                    yield_rolling_power_rows(plan, first_row, csvrdr, args.window)
+                )
+            elif args.resample:
+                writer.writerows(
+                    yield_resampled_power_rows(plan, first_row, csvrdr, args.resample)
+                )
+            else:
+                writer.writerows(yield_power_rows(plan, first_row, csvrdr))
 
 
 if __name__ == "__main__":
@@ -4,7 +4,9 @@ import sys
 import csv
 import argparse
 import re
-from typing import Any, Iterable, Optional, Sequence, Set, Tuple, Union
+from typing import Any, List, Optional, Sequence
+
+from commented_csv import CommentedReader, parse_line
 
 
 def log(*args: Any) -> None:
@@ -37,37 +39,20 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="log the number of every filtered data row",
+        required=False,
+        default=False,
+    )
     return parser
 
 
-def read_input_file(f: Iterable) -> Tuple[csv.reader, csv.DictReader]:
-    meta, fieldnames, data = [], [], []
-    is_fieldnames = True
-    for row in f:
-        if row.strip().startswith("#"):
-            meta.append(row)
-        elif is_fieldnames:
-            fieldnames.append(row)
-            is_fieldnames = False
-        else:
-            data.append(row)
-    if not fieldnames:
-        raise AssertionError("File has no fieldnames")
-    if not data:
-        raise AssertionError("File has no data rows")
-    return csv.reader(meta), csv.DictReader(data, next(iter(csv.reader(fieldnames))))
-
-
-def filterable_fields(fieldnames: Sequence, pattern: str) -> Set:
+def filterable_fields(fieldnames: Sequence, pattern: str) -> List[int]:
     prog = re.compile(pattern)
-    return {f for f in fieldnames if prog.match(f)}
-
-
-def float_or_int(s: str) -> Union[float, str]:
-    try:
-        return int(s)
-    except ValueError:
-        return float(s)
+    return [ix for ix, f in enumerate(fieldnames) if prog.match(f)]
 
 
 def main():
@@ -76,26 +61,33 @@ def main():
     )
     args = add_arguments(parser).parse_args()
     with read_from(args.source_file) as f:
-        meta, data = read_input_file(f)
-        ffields = filterable_fields(data.fieldnames, r".+/.+/$")
         with output_to(args.output) as of:
-            csv.writer(of).writerows(meta)
-            dwriter = csv.DictWriter(of, data.fieldnames)
-            dwriter.writeheader()
-            first_row = next(iter(data), None)
+            writer = csv.writer(of)
+            csvrdr = CommentedReader(
+                f, on_comment=lambda x: writer.writerow(parse_line(x))
+            )
+            fieldnames = csvrdr.fieldnames
+            if not fieldnames:
+                raise AssertionError("File has no fieldnames")
+            ffields = filterable_fields(fieldnames, r".+/.+/$")
+            writer.writerows(csvrdr.meta)
+            writer.writerow(fieldnames)
+            reader = iter(csvrdr)
+            first_row = next(reader, None)
             if first_row is None:
                 raise AssertionError("File has no data rows")
-            dwriter.writerow(first_row)
-            # Add one because the count starts from the next line
-            # Add two because both the fieldname and first data lines are not considered
-            for ln, row in enumerate(data, start=meta.line_num + 2 + 1):
-                if all(
-                    float_or_int(val)
-                    for val in (v for k, v in row.items() if k in ffields)
-                ):
-                    dwriter.writerow(row)
+            writer.writerow(first_row)
+            total, filtered = 0, 0
+            for row in reader:
+                total += 1
+                if all(float(row[ix]) for ix in ffields):
+                    writer.writerow(row)
                 else:
-                    log("filtered out line", ln)
+                    filtered += 1
+                    if args.verbose:
+                        log("filtered out data row", total + 1)
+            if filtered:
+                log("filtered out {} of {} data lines".format(filtered, total))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import functools
+import inspect
+import math
+import shlex
+import statistics as stat
+import sys
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from commented_csv import CommentedReader, Number, int_or_float
+
+
+class Stream(NamedTuple):
+    meta: List[List[str]]
+    fieldnames: List[str]
+    rows: Iterator[List[Any]]
+
+
+Stage = Callable[[Stream], Stream]
+
+
+def read_from(path: Optional[str]) -> Any:
+    return sys.stdin if not path else open(path, "r")
+
+
+def output_to(path: Optional[str]) -> Any:
+    return sys.stdout if not path else open(path, "w")
+
+
+def number(x: Any) -> Number:
+    return int_or_float(x) if isinstance(x, str) else x
+
+
+def read_stream(f: Any, delimiter: str = ",") -> Stream:
+    reader = CommentedReader(f, delimiter=delimiter, on_comment=lambda x: None)
+    if reader.fieldnames is None:
+        raise AssertionError("File has no fieldnames")
+    return Stream(reader.meta, reader.fieldnames, iter(reader))
+
+
+def write_stream(stream: Stream, f: Any) -> None:
+    writer = csv.writer(f)
+    writer.writerows(stream.meta)
+    writer.writerow(stream.fieldnames)
+    writer.writerows(stream.rows)
+
+
+def _index(stream: Stream, field: str) -> int:
+    try:
+        return stream.fieldnames.index(field)
+    except ValueError:
+        raise AssertionError("{} is not a valid fieldname".format(field))
+
+
+def _split(x: Optional[str]) -> List[str]:
+    return x.split(",") if x else []
+
+
+def filter_comments(stream: Stream) -> Stream:
+    return stream._replace(meta=[])
+
+
+def select(stream: Stream, column: str = "section", value: str = "") -> Stream:
+    ix = _index(stream, column)
+    return stream._replace(rows=(r for r in stream.rows if r[ix] == value))
+
+
+def fields(stream: Stream, names: str = "") -> Stream:
+    ixs = [_index(stream, n) for n in _split(names)]
+    return Stream(
+        stream.meta,
+        [stream.fieldnames[i] for i in ixs],
+        ([r[i] for i in ixs] for r in stream.rows),
+    )
+
+
+def head(stream: Stream, n: str = "10") -> Stream:
+    count = int(n)
+    return stream._replace(rows=(r for _, r in zip(range(count), stream.rows)))
+
+
+def tail(stream: Stream, n: str = "10") -> Stream:
+    count = int(n)
+
+    def rows():
+        yield from deque(stream.rows, maxlen=count)
+
+    return stream._replace(rows=rows())
+
+
+def relative_time(
+    stream: Stream, column: str = "time", amount: Optional[str] = None
+) -> Stream:
+    ix = _index(stream, column)
+
+    def rows():
+        offset = number(amount) if amount is not None else None
+        for r in stream.rows:
+            value = number(r[ix])
+            if offset is None:
+                offset = value
+            r[ix] = value - offset
+            yield r
+
+    return stream._replace(rows=rows())
+
+
+_OPERATIONS: Dict[str, Callable[[Number, Number], Number]] = {
+    "sub": lambda x, y: x - y,
+    "add": lambda x, y: x + y,
+    "mul": lambda x, y: x * y,
+    "div": lambda x, y: x / y,
+}
+
+
+def column_op(
+    stream: Stream,
+    op: str = "sub",
+    fields: str = "",
+    values: Optional[str] = None,
+    operand: str = "right",
+) -> Stream:
+    if op not in _OPERATIONS:
+        raise AssertionError("Invalid operation {}".format(op))
+    func = _OPERATIONS[op]
+    if operand == "left":
+        func = functools.partial(lambda f, x, y: f(y, x), func)
+    ixs = [_index(stream, x) for x in _split(fields)]
+    given = [number(x) for x in _split(values)] if values else None
+    if given is not None and len(given) != len(ixs):
+        raise AssertionError("values count must equal fields count")
+
+    def rows():
+        operands = given
+        for r in stream.rows:
+            if operands is None:
+                operands = [number(r[i]) for i in ixs]
+            for i, v in zip(ixs, operands):
+                r[i] = func(number(r[i]), v)
+            yield r
+
+    return stream._replace(rows=rows())
+
+
+def compact(stream: Stream, factor: str = "1", mode: str = "first") -> Stream:
+    size = int(factor)
+    if size < 1:
+        raise AssertionError("factor must be >= 1")
+
+    def average(block: List[List[Any]]) -> List[Any]:
+        result = []
+        for col in zip(*block):
+            values = [number(x) for x in col]
+            mean = math.fsum(values) / len(values)
+            result.append(int(round(mean)) if isinstance(values[0], int) else mean)
+        return result
+
+    def rows():
+        block = []
+        for r in stream.rows:
+            block.append(r)
+            if len(block) == size:
+                yield block[0] if mode == "first" else average(block)
+                block = []
+        if block:
+            yield block[0] if mode == "first" else average(block)
+
+    if mode not in ("first", "avg"):
+        raise AssertionError("Invalid compact mode {}".format(mode))
+    return stream._replace(rows=rows())
+
+
+def stats(stream: Stream, field: str = "") -> Stream:
+    ix = _index(stream, field)
+
+    def rows():
+        col = [number(r[ix]) for r in stream.rows]
+        if not col:
+            return
+        mean = stat.mean(col)
+        stdev = stat.stdev(col) if len(col) > 1 else 0
+        variance = stat.variance(col, xbar=mean) if len(col) > 1 else 0
+        yield [field, mean, stat.median(col), stat.mode(col), stdev, variance]
+
+    return Stream(
+        stream.meta,
+        ["field", "mean", "median", "mode", "stddev", "variance"],
+        rows(),
+    )
+
+
+STAGES: Dict[str, Callable[..., Stream]] = {
+    "filter_comments": filter_comments,
+    "select": select,
+    "fields": fields,
+    "head": head,
+    "tail": tail,
+    "relative_time": relative_time,
+    "column_op": column_op,
+    "compact": compact,
+    "stats": stats,
+}
+
+
+def parse_spec(spec: str) -> List[Stage]:
+    stages = []
+    for part in spec.split("|"):
+        tokens = shlex.split(part)
+        if not tokens:
+            continue
+        name, options = tokens[0], {}
+        if name not in STAGES:
+            raise AssertionError(
+                "Invalid stage {}, expected one of {}".format(name, ", ".join(STAGES))
+            )
+        for token in tokens[1:]:
+            key, sep, value = token.partition("=")
+            if not sep:
+                raise AssertionError("Stage option {} must be KEY=VALUE".format(token))
+            options[key] = value
+        try:
+            inspect.signature(STAGES[name]).bind(None, **options)
+        except TypeError as err:
+            raise AssertionError("Stage {}: {}".format(name, err))
+        stages.append(functools.partial(STAGES[name], **options))
+    return stages
+
+
+def run(stream: Stream, stages: Iterable[Stage]) -> Stream:
+    for stage in stages:
+        stream = stage(stream)
+    return stream
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument(
+        "spec",
+        action="store",
+        help="stages separated by '|', each as NAME [KEY=VALUE ...] (stages: {})".format(
+            ", ".join(STAGES)
+        ),
+        type=str,
+    )
+    parser.add_argument(
+        "source_file",
+        action="store",
+        help="input file (default: stdin)",
+        nargs="?",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        help="output file (default: stdout)",
+        required=False,
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "-s",
+        "--separator",
+        action="store",
+        help="CSV field separator",
+        required=False,
+        type=str,
+        default=",",
+    )
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a chain of CSV processing stages in a single process"
+    )
+    args = add_arguments(parser).parse_args()
+    try:
+        stages = parse_spec(args.spec)
+    except (AssertionError, ValueError) as err:
+        parser.error(str(err))
+    with read_from(args.source_file) as f:
+        stream = run(read_stream(f, delimiter=args.separator), stages)
+        with output_to(args.output) as of:
+            write_stream(stream, of)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Binary sidecar cache for parsed profiler output.
+
+Each cached source is stored as two files in the cache directory:
+<key>.bin holds every array back to back and is memory-mapped on load,
+followed by int64 tables of (offset, dtype, shape) references to them and
+of executions; <key>.json holds the group/section tree, each distinct
+range, extra or device layout once, and the size and mtime of the source
+it was built from (a change in either invalidates the entry).
+Entries are evicted least recently used first once the cache grows
+beyond its size budget.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import numpy as np
+
+from profiler_loader import Device, Execution, Group, Profile, Section, load_profile
+
+VERSION = 2
+DEFAULT_BUDGET = 1 << 30
+_ALIGN = 8
+_FLUSH_BYTES = 1 << 20
+
+
+def _key(path: str) -> str:
+    return hashlib.blake2b(os.path.realpath(path).encode(), digest_size=16).hexdigest()
+
+
+class _ArrayWriter:
+    # small arrays are gathered into one write
+    def __init__(self, f: BinaryIO) -> None:
+        self.f = f
+        self.offset = 0
+        self.pending = bytearray()
+
+    def write(self, a: np.ndarray) -> List[Any]:
+        a = np.ascontiguousarray(a)
+        pad = -self.offset % _ALIGN
+        if pad:
+            self.pending += b"\0" * pad
+            self.offset += pad
+        ref = [self.offset, a.dtype.str, list(a.shape)]
+        self.pending += a.tobytes()
+        self.offset += a.nbytes
+        if len(self.pending) >= _FLUSH_BYTES:
+            self.flush()
+        return ref
+
+    def flush(self) -> None:
+        self.f.write(self.pending)
+        self.pending = bytearray()
+
+
+class _Interner:
+    # equal JSON values (ranges, extras, device layouts) are stored once
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+        self.ids: Dict[str, int] = {}
+
+    def __call__(self, value: Any, key: Optional[Any] = None) -> int:
+        if key is None:
+            key = json.dumps(value)
+        ix = self.ids.get(key)
+        if ix is None:
+            ix = self.ids[key] = len(self.values)
+            self.values.append(value)
+        return ix
+
+
+class _Dump:
+    def __init__(self, w: _ArrayWriter) -> None:
+        self.w = w
+        self.intern = _Interner()
+        self.dtypes = _Interner()
+        # one row per array: offset, dtype id, ndim, shape
+        self.refs: List[List[int]] = []
+        # one row per execution: layout id, range id, first row in refs
+        self.executions: List[List[int]] = []
+
+    def array(self, a: np.ndarray) -> None:
+        offset, dtype, shape = self.w.write(a)
+        self.refs.append([offset, self.dtypes(dtype), len(shape)] + shape)
+
+    def execution(self, e: Execution) -> int:
+        layout = {
+            "cpu": [[d.index, list(d.series)] for d in e.cpu],
+            "gpu": [[d.index, list(d.series)] for d in e.gpu],
+        }
+        # a tuple spares encoding the layout of every execution
+        key = tuple(
+            (target, d.index, tuple(d.series))
+            for target, devices in (("cpu", e.cpu), ("gpu", e.gpu))
+            for d in devices
+        )
+        self.executions.append(
+            [self.intern(layout, key), self.intern(e.range), len(self.refs)]
+        )
+        self.array(e.sample_times)
+        for d in e.cpu + e.gpu:
+            for v in d.series.values():
+                self.array(v)
+        return len(self.executions) - 1
+
+    def table(self, rows: List[List[int]], width: int) -> List[Any]:
+        table = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            table[i, : len(row)] = row
+        return self.w.write(table)
+
+    def profile(self, p: Profile) -> Dict[str, Any]:
+        idle = self.execution(p.idle) if p.idle is not None else None
+        groups = [
+            [
+                g.label,
+                self.intern(g.extra),
+                [
+                    [
+                        s.label,
+                        self.intern(s.extra),
+                        [self.execution(e) for e in s.executions],
+                    ]
+                    for s in g.sections
+                ],
+            ]
+            for g in p.groups
+        ]
+        # executions are numbered in order, a section only keeps its range
+        for g in groups:
+            for s in g[2]:
+                s[2] = [s[2][0], s[2][-1] + 1] if s[2] else [0, 0]
+        width = 3 + max((len(r) - 3 for r in self.refs), default=0)
+        return {
+            "format": p.format,
+            "units": p.units,
+            "idle": idle,
+            "groups": groups,
+            "values": self.intern.values,
+            "dtypes": self.dtypes.values,
+            "refs": self.table(self.refs, width),
+            "executions": self.table(self.executions, 3),
+        }
+
+
+def _load_profile(data: np.ndarray, tree: Dict[str, Any]) -> Profile:
+    # values shared by equal ranges/extras are the same objects
+    values = tree["values"]
+    dtypes = [np.dtype(x) for x in tree["dtypes"]]
+
+    def table(ref: List[Any]) -> List[List[int]]:
+        offset, dtype, shape = ref
+        count = int(np.prod(shape, dtype=np.int64))
+        return data[offset : offset + count * 8].view(dtype).reshape(shape).tolist()
+
+    refs = table(tree["refs"])
+
+    def array(row: List[int]) -> np.ndarray:
+        ndim = row[2]
+        return np.ndarray(row[3 : 3 + ndim], dtypes[row[1]], data, row[0])
+
+    def execution(row: List[int]) -> Execution:
+        layout_id, range_id, ix = row
+        layout = values[layout_id]
+        sample_times = array(refs[ix])
+        ix += 1
+        devices = {}
+        for target in ("cpu", "gpu"):
+            devices[target] = []
+            for index, names in layout[target]:
+                series = {}
+                for name in names:
+                    series[name] = array(refs[ix])
+                    ix += 1
+                devices[target].append(Device(index, series))
+        return Execution(sample_times, devices["cpu"], devices["gpu"], values[range_id])
+
+    executions = [execution(row) for row in table(tree["executions"])]
+    return Profile(
+        tree["format"],
+        tree["units"],
+        executions[tree["idle"]] if tree["idle"] is not None else None,
+        [
+            Group(
+                label,
+                values[extra],
+                [
+                    Section(s_label, values[s_extra], executions[first:last])
+                    for s_label, s_extra, (first, last) in sections
+                ],
+            )
+            for label, extra, sections in tree["groups"]
+        ],
+    )
+
+
+class ProfileCache:
+    def __init__(self, directory: str, budget: int = DEFAULT_BUDGET) -> None:
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".bin"
+
+    def _lookup(self, path: str, st: os.stat_result) -> Optional[Profile]:
+        meta_path, data_path = self._paths(_key(path))
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        source = meta.get("source", {})
+        if (
+            meta.get("version") != VERSION
+            or source.get("size") != st.st_size
+            or source.get("mtime_ns") != st.st_mtime_ns
+        ):
+            return None
+        try:
+            if meta["nbytes"]:
+                # a plain view: slicing a memmap costs a subclass finalizer
+                data = np.memmap(data_path, dtype=np.uint8, mode="r").view(np.ndarray)
+            else:
+                data = np.empty(0, dtype=np.uint8)
+        except (OSError, ValueError):
+            return None
+        # mtime of the index file doubles as the last access time for eviction
+        os.utime(meta_path)
+        return _load_profile(data, meta["tree"])
+
+    def _store(self, path: str, st: os.stat_result, profile: Profile) -> None:
+        meta_path, data_path = self._paths(_key(path))
+        try:
+            os.remove(meta_path)
+        except OSError:
+            pass
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=self.directory, suffix=".tmp", delete=False
+        ) as f:
+            writer = _ArrayWriter(f)
+            tree = _Dump(writer).profile(profile)
+            writer.flush()
+        os.replace(f.name, data_path)
+        meta = {
+            "version": VERSION,
+            "source": {
+                "path": os.path.realpath(path),
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+            },
+            "nbytes": writer.offset,
+            "tree": tree,
+        }
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(meta, f)
+        os.replace(f.name, meta_path)
+        self.evict(keep=meta_path)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            data_path = meta_path[: -len(".json")] + ".bin"
+            try:
+                size = os.path.getsize(meta_path) + os.path.getsize(data_path)
+                atime = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            entries.append((atime, meta_path, data_path, size))
+            total += size
+        for _, meta_path, data_path, size in sorted(entries):
+            if total <= self.budget:
+                break
+            if meta_path == keep:
+                continue
+            for p in (meta_path, data_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+    def load(self, path: str) -> Profile:
+        st = os.stat(path)
+        profile = self._lookup(path, st)
+        if profile is None:
+            with open(path, "r") as f:
+                profile = load_profile(f)
+            self._store(path, st, profile)
+        return profile
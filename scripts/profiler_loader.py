@@ -0,0 +1,230 @@
+"""Columnar loader for energy profiler JSON output.
+
+The file is parsed with json and the sample timestamps and device
+readings of each execution are turned into contiguous NumPy arrays as
+soon as it is reached, instead of keeping nested lists of Python floats.
+"""
+
+import json
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from profiler_reader import ExecutionSummary, SectionSummary
+
+_DEVICE_INDEX = ("socket", "device")
+_FLATTEN_ROWS = 64
+
+
+class Device:
+    __slots__ = ("index", "series")
+
+    def __init__(self, index: Optional[int], series: Dict[str, np.ndarray]) -> None:
+        self.index = index
+        self.series = series
+
+    def __repr__(self) -> str:
+        return "Device(index={}, series={})".format(self.index, list(self.series))
+
+
+class Execution:
+    __slots__ = ("sample_times", "cpu", "gpu", "range")
+
+    def __init__(
+        self,
+        sample_times: np.ndarray,
+        cpu: List[Device],
+        gpu: List[Device],
+        range: Optional[Dict[str, Any]],
+    ) -> None:
+        self.sample_times = sample_times
+        self.cpu = cpu
+        self.gpu = gpu
+        self.range = range
+
+    def __repr__(self) -> str:
+        return "Execution(samples={}, cpu={}, gpu={})".format(
+            self.samples, len(self.cpu), len(self.gpu)
+        )
+
+    @property
+    def samples(self) -> int:
+        return len(self.sample_times)
+
+    @property
+    def duration(self) -> int:
+        return int(self.sample_times[-1] - self.sample_times[0]) if self.samples else 0
+
+    def readings(self, target: str, index: int, series: str) -> np.ndarray:
+        return getattr(self, target)[index].series[series]
+
+    def energy(self, target: str, index: int, series: str) -> np.ndarray:
+        return energy_deltas(self.readings(target, index, series))
+
+    def power(self, target: str, index: int, series: str) -> np.ndarray:
+        return power(self.sample_times, self.readings(target, index, series))
+
+
+class Section:
+    __slots__ = ("label", "extra", "executions")
+
+    def __init__(
+        self, label: Optional[str], extra: Any, executions: List[Execution]
+    ) -> None:
+        self.label = label
+        self.extra = extra
+        self.executions = executions
+
+    def __repr__(self) -> str:
+        return "Section(label={!r}, executions={})".format(
+            self.label, len(self.executions)
+        )
+
+
+class Group:
+    __slots__ = ("label", "extra", "sections")
+
+    def __init__(self, label: Optional[str], extra: Any, sections: List[Section]):
+        self.label = label
+        self.extra = extra
+        self.sections = sections
+
+    def __repr__(self) -> str:
+        return "Group(label={!r}, sections={})".format(self.label, len(self.sections))
+
+
+class Profile:
+    __slots__ = ("format", "units", "idle", "groups")
+
+    def __init__(
+        self,
+        format: Dict[str, List[str]],
+        units: Dict[str, str],
+        idle: Optional[Execution],
+        groups: List[Group],
+    ) -> None:
+        self.format = format
+        self.units = units
+        self.idle = idle
+        self.groups = groups
+
+    def __repr__(self) -> str:
+        return "Profile(groups={})".format(len(self.groups))
+
+    def sections(self) -> Iterable[Section]:
+        for g in self.groups:
+            yield from g.sections
+
+    def executions(self) -> Iterable[Execution]:
+        for s in self.sections():
+            yield from s.executions
+
+
+def execution_summaries(profile: Profile) -> Iterable[ExecutionSummary]:
+    for g in profile.groups:
+        for s in g.sections:
+            for idx, e in enumerate(s.executions, start=1):
+                first = e.sample_times[0].item() if e.samples else None
+                last = e.sample_times[-1].item() if e.samples else None
+                yield ExecutionSummary(g.label, s.label, idx, e.samples, first, last)
+
+
+def section_summaries(profile: Profile) -> Iterable[SectionSummary]:
+    for g in profile.groups:
+        for s in g.sections:
+            yield SectionSummary(g.label, s.label, len(s.executions))
+
+
+def energy_deltas(readings: np.ndarray) -> np.ndarray:
+    return np.diff(readings, axis=0)
+
+
+def total_energy(readings: np.ndarray) -> np.ndarray:
+    return readings[-1] - readings[0] if len(readings) else np.zeros(readings.shape[1:])
+
+
+def power(sample_times: np.ndarray, readings: np.ndarray) -> np.ndarray:
+    seconds = np.diff(sample_times) * 1e-9
+    return energy_deltas(readings) / seconds.reshape((-1,) + (1,) * (readings.ndim - 1))
+
+
+def _to_times(values: Optional[List[Any]]) -> np.ndarray:
+    if not values:
+        return np.empty(0, dtype=np.int64)
+    # int64 unless a timestamp is fractional
+    times = np.asarray(values)
+    if times.dtype.kind not in "if":
+        raise AssertionError("Sample times must be numbers")
+    return times
+
+
+def _to_readings(name: str, values: List[Any]) -> np.ndarray:
+    rows = len(values)
+    try:
+        width = len(values[0])
+        # flattening only pays off beyond a few rows
+        if rows >= _FLATTEN_ROWS and all(len(r) == width for r in values):
+            flat = chain.from_iterable(values)
+            readings = np.fromiter(flat, dtype=np.float64, count=rows * width)
+            return readings.reshape(rows, width)
+    except TypeError:
+        # a reading that is not a list, or null
+        pass
+    try:
+        # null readings become nan
+        readings = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise AssertionError(
+            "Readings of {} must have the same number of values".format(name)
+        )
+    if readings.ndim != 2:
+        raise AssertionError("Reading of {} must be a list".format(name))
+    return readings
+
+
+def _to_devices(devices: List[Dict[str, Any]]) -> List[Device]:
+    result = []
+    for d in devices:
+        index = next((d[k] for k in _DEVICE_INDEX if k in d), None)
+        series = {
+            k: _to_readings(k, v) for k, v in d.items() if isinstance(v, list) and v
+        }
+        result.append(Device(index, series))
+    return result
+
+
+def _to_execution(e: Dict[str, Any]) -> Execution:
+    return Execution(
+        _to_times(e.get("sample_times")),
+        _to_devices(e.get("cpu", [])),
+        _to_devices(e.get("gpu", [])),
+        e.get("range"),
+    )
+
+
+def load_profile(f: Any) -> Profile:
+    root = json.load(f)
+    if not isinstance(root, dict) or "groups" not in root:
+        raise AssertionError("Not a profiler output file")
+    idle = root.get("idle")
+    return Profile(
+        root.get("format", {}),
+        root.get("units", {}),
+        _to_execution(idle) if isinstance(idle, dict) else None,
+        [
+            Group(
+                g.get("label"),
+                g.get("extra"),
+                [
+                    Section(
+                        s.get("label"),
+                        s.get("extra"),
+                        [_to_execution(e) for e in s.get("executions", [])],
+                    )
+                    for s in g.get("sections", [])
+                ],
+            )
+            for g in root["groups"]
+        ],
+    )
@@ -0,0 +1,289 @@
+"""Summaries of energy profiler JSON output.
+
+The load_* functions parse the whole file with json, which is fastest.
+The iter_* functions tokenize the input in fixed-size chunks and walk
+the groups -> sections -> executions hierarchy without materializing
+the sample lists, so memory use does not depend on the file size.
+"""
+
+import json
+import re
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+CHUNK_SIZE = 1 << 16
+# longest number/literal token that may be split across two chunks
+_LOOKAHEAD = 64
+
+_TOKEN = re.compile(
+    r"""[\s]*(?:
+        ([\[\]{}:,])
+        |("(?:[^"\\]|\\.)*")
+        |(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+        |(true|false|null)
+    )""",
+    re.VERBOSE,
+)
+_WHITESPACE = re.compile(r"\s*")
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+_SKIPPABLE = re.compile(r'[^"\[\]{},]*')
+_LITERALS = {"true": True, "false": False, "null": None}
+
+Event = Tuple[str, str, Any]
+
+
+class ExecutionSummary(NamedTuple):
+    group: Optional[str]
+    section: Optional[str]
+    execution: int
+    samples: int
+    first: Optional[int]
+    last: Optional[int]
+
+    @property
+    def duration(self) -> Union[int, float]:
+        if self.first is None or self.last is None:
+            return 0
+        return self.last - self.first
+
+
+class SectionSummary(NamedTuple):
+    group: Optional[str]
+    section: Optional[str]
+    executions: int
+
+
+def _decode_string(token: str) -> str:
+    return token[1:-1] if "\\" not in token else json.loads(token)
+
+
+def _decode_number(token: str) -> Union[int, float]:
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+
+class _Tokenizer:
+    def __init__(self, f: Any, chunk_size: int) -> None:
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _refill(self) -> bool:
+        chunk = self.f.read(self.chunk_size) if not self.eof else ""
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def _error(self) -> AssertionError:
+        return AssertionError(
+            "Malformed JSON near: {}".format(self.buf[self.pos : self.pos + 32].strip())
+        )
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        while True:
+            m = _TOKEN.match(self.buf, self.pos)
+            # a token near the end of the buffer may continue in the next chunk
+            if not self.eof and (m is None or m.end() + _LOOKAHEAD > len(self.buf)):
+                self._refill()
+                continue
+            if m is None:
+                if _WHITESPACE.match(self.buf, self.pos).end() == len(self.buf):
+                    return
+                raise self._error()
+            self.pos = m.end()
+            punct, string, number, literal = m.groups()
+            if punct is not None:
+                yield punct, None
+            elif string is not None:
+                yield "string", _decode_string(string)
+            elif number is not None:
+                yield "number", _decode_number(number)
+            else:
+                yield "literal", _LITERALS[literal]
+
+    def skip_value(self) -> None:
+        # scan to the end of the next value without decoding it
+        depth = 0
+        while True:
+            self.pos = _SKIPPABLE.match(self.buf, self.pos).end()
+            if self.pos == len(self.buf):
+                if not self._refill():
+                    raise self._error()
+                continue
+            c = self.buf[self.pos]
+            if c == '"':
+                m = _STRING.match(self.buf, self.pos)
+                if m is None:
+                    if not self._refill():
+                        raise self._error()
+                    continue
+                self.pos = m.end()
+            elif c in "[{":
+                depth += 1
+                self.pos += 1
+            elif depth == 0:
+                return
+            elif c in "]}":
+                depth -= 1
+                self.pos += 1
+                if depth == 0:
+                    return
+            else:
+                self.pos += 1
+
+
+def iter_tokens(f: Any, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    return iter(_Tokenizer(f, chunk_size))
+
+
+def iter_events(
+    f: Any, chunk_size: int = CHUNK_SIZE, skip: Iterable[str] = ()
+) -> Iterator[Event]:
+    skip = frozenset(skip)
+    tokenizer = _Tokenizer(f, chunk_size)
+    prefixes: List[str] = [""]
+    containers: List[str] = []
+    expect_key = False
+
+    def push(name: str) -> None:
+        prefixes.append("{}.{}".format(prefixes[-1], name) if prefixes[-1] else name)
+
+    for kind, value in tokenizer:
+        if kind == ",":
+            if containers[-1] == "{":
+                prefixes.pop()
+                expect_key = True
+            continue
+        if kind == ":":
+            if prefixes[-1] in skip:
+                tokenizer.skip_value()
+            continue
+        if expect_key:
+            if kind == "}":
+                containers.pop()
+                expect_key = False
+                yield prefixes[-1], "end_map", None
+                continue
+            if kind != "string":
+                raise AssertionError("Expected object key, got {}".format(kind))
+            yield prefixes[-1], "map_key", value
+            push(value)
+            expect_key = False
+            continue
+        if kind == "{":
+            yield prefixes[-1], "start_map", None
+            containers.append("{")
+            expect_key = True
+        elif kind == "[":
+            yield prefixes[-1], "start_array", None
+            containers.append("[")
+            push("item")
+        elif kind == "]":
+            containers.pop()
+            prefixes.pop()
+            yield prefixes[-1], "end_array", None
+        elif kind == "}":
+            containers.pop()
+            prefixes.pop()
+            yield prefixes[-1], "end_map", None
+        else:
+            yield prefixes[-1], kind, value
+
+
+_GROUP = "groups.item"
+_GROUP_LABEL = "groups.item.label"
+_SECTION = "groups.item.sections.item"
+_SECTION_LABEL = "groups.item.sections.item.label"
+_EXECUTION = "groups.item.sections.item.executions.item"
+_SAMPLE_TIME = "groups.item.sections.item.executions.item.sample_times.item"
+# per-device readings and address ranges are not needed for the summaries
+_SKIP = frozenset(
+    ["idle"] + ["{}.{}".format(_EXECUTION, k) for k in ("cpu", "gpu", "range")]
+)
+
+
+def _iter_sections(
+    events: Iterable[Event],
+) -> Iterator[Tuple[Optional[str], Optional[str], List[Tuple[int, Any, Any]]]]:
+    # keys may come in any order, e.g. a section's "label" after its "executions"
+    group_label = None
+    group_known = False
+    pending: List[Tuple[Optional[str], List]] = []
+    section_label = None
+    executions: List[Tuple[int, Any, Any]] = []
+    samples, first, last = 0, None, None
+    for prefix, event, value in events:
+        if prefix == _SAMPLE_TIME:
+            if samples == 0:
+                first = value
+            last = value
+            samples += 1
+        elif prefix == _EXECUTION:
+            if event == "start_map":
+                samples, first, last = 0, None, None
+            elif event == "end_map":
+                executions.append((samples, first, last))
+        elif prefix == _SECTION:
+            if event == "start_map":
+                section_label = None
+                executions = []
+            elif event == "end_map":
+                if group_known:
+                    yield group_label, section_label, executions
+                else:
+                    pending.append((section_label, executions))
+        elif prefix == _SECTION_LABEL or prefix == _GROUP_LABEL:
+            if event in ("string", "number", "literal"):
+                if prefix == _SECTION_LABEL:
+                    section_label = value
+                else:
+                    group_label = value
+                    group_known = True
+                    for label, execs in pending:
+                        yield group_label, label, execs
+                    pending.clear()
+        elif prefix == _GROUP:
+            if event == "start_map":
+                group_label = None
+                group_known = False
+            elif event == "end_map":
+                for label, execs in pending:
+                    yield group_label, label, execs
+                pending.clear()
+
+
+def iter_section_summaries(
+    f: Any, chunk_size: int = CHUNK_SIZE
+) -> Iterator[SectionSummary]:
+    for group, section, executions in _iter_sections(iter_events(f, chunk_size, _SKIP)):
+        yield SectionSummary(group, section, len(executions))
+
+
+def iter_execution_summaries(
+    f: Any, chunk_size: int = CHUNK_SIZE
+) -> Iterator[ExecutionSummary]:
+    for group, section, executions in _iter_sections(iter_events(f, chunk_size, _SKIP)):
+        for idx, (samples, first, last) in enumerate(executions, start=1):
+            yield ExecutionSummary(group, section, idx, samples, first, last)
+
+
+def load_section_summaries(f: Any) -> Iterator[SectionSummary]:
+    for g in json.load(f)["groups"]:
+        for s in g["sections"]:
+            yield SectionSummary(g.get("label"), s.get("label"), len(s["executions"]))
+
+
+def load_execution_summaries(f: Any) -> Iterator[ExecutionSummary]:
+    for g in json.load(f)["groups"]:
+        for s in g["sections"]:
+            for idx, e in enumerate(s["executions"], start=1):
+                times = e.get("sample_times", [])
+                first, last = (times[0], times[-1]) if times else (None, None)
+                yield ExecutionSummary(
+                    g.get("label"), s.get("label"), idx, len(times), first, last
+                )
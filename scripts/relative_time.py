@@ -2,8 +2,20 @@
 
 import argparse
 import csv
+import functools
+import glob
+import os
 import sys
-from typing import Any, Dict, Iterable, Optional, Tuple, Union
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Deque, List, Optional, Tuple, Union
+
+from commented_csv import CommentedReader, ColumnTypes, int_or_float, parse_line
+
+CHUNK_ROWS = 1 << 14
+
+Number = Union[int, float]
 
 
 def read_from(path: Optional[str]) -> Any:
@@ -14,13 +26,6 @@ def output_to(path: Optional[str]) -> Any:
     return sys.stdout if not path else open(path, "w")
 
 
-def int_or_float(s: str) -> Union[int, float]:
-    try:
-        return int(s)
-    except ValueError:
-        return float(s)
-
-
 def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     def _int_or_float(s: str) -> Union[int, float]:
         try:
@@ -31,18 +36,18 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
             )
 
     parser.add_argument(
-        "source_file",
+        "source_files",
         action="store",
-        help="file to convert (default: stdin)",
-        nargs="?",
+        help="files to convert (default: stdin)",
+        nargs="*",
         type=str,
-        default=None,
     )
     parser.add_argument(
         "-o",
         "--output",
         action="store",
-        help="destination file (default: stdout)",
+        help="destination file (default: stdout, or next to each of several "
+        "files with --suffix)",
         required=False,
         type=str,
         default=None,
@@ -60,56 +65,216 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
         "-c",
         "--column",
+        action="extend",
+        help="column(s) to consider as time, comma-separated or repeated, all "
+        "rebased by the same amount (default: time)",
+        required=False,
+        type=lambda x: x.split(","),
+        default=None,
+        metavar="NAME",
+    )
+    parser.add_argument(
+        "-r",
+        "--reference",
+        action="store",
+        help="subtract the first --reference-column value of this file; "
+        "{dir}, {name} and {stem} are replaced with the directory, name and "
+        "name without extension of each source file and glob patterns must "
+        "match exactly one file, e.g. '{dir}/*.timeprinter.csv'",
+        required=False,
+        type=str,
+        default=None,
+        metavar="PATTERN",
+    )
+    parser.add_argument(
+        "--reference-column",
         action="store",
-        help="column to consider as time (default: time)",
+        help="time column of the reference file (default: %(default)s)",
         required=False,
+        type=str,
         default="time",
         metavar="NAME",
     )
+    parser.add_argument(
+        "--drift",
+        action="store",
+        help="rescale the relative times of a clock running PPM parts per "
+        "million slow (negative: fast), as fitted by ground_truth_compare.py "
+        "--align (default: 0)",
+        required=False,
+        type=float,
+        default=0.0,
+        metavar="PPM",
+    )
+    parser.add_argument(
+        "--suffix",
+        action="store",
+        help="with several files, write each to its name with SUFFIX before "
+        "the extension (default: %(default)s)",
+        required=False,
+        type=str,
+        default=".relative",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        help="number of worker processes for many files (default: CPU count)",
+        required=False,
+        type=int,
+        default=None,
+    )
     return parser
 
 
-def read_input_file(f: Iterable) -> Tuple[csv.reader, csv.DictReader]:
-    meta, fieldnames, data = [], [], []
-    is_fieldnames = True
-    for row in f:
-        if row.strip().startswith("#"):
-            meta.append(row)
-        elif is_fieldnames:
-            fieldnames.append(row)
-            is_fieldnames = False
-        else:
-            data.append(row)
-    if not fieldnames:
+def reference_path(pattern: str, path: Optional[str]) -> str:
+    name = os.path.basename(path) if path else ""
+    resolved = pattern.format(
+        dir=os.path.dirname(path) or "." if path else ".",
+        name=name,
+        stem=os.path.splitext(name)[0],
+    )
+    matches = glob.glob(resolved)
+    if len(matches) != 1:
+        raise AssertionError(
+            "Reference {} matches {} files, expected 1".format(resolved, len(matches))
+        )
+    return matches[0]
+
+
+def reference_amount(path: str, column: str) -> Number:
+    from extract_time import IndexedTimes
+
+    with open(path, "rb") as f:
+        index = IndexedTimes(f)
+        if not index.fieldnames or column not in index.fieldnames:
+            raise AssertionError("{}: {} is not a valid fieldname".format(path, column))
+        row = index.first()
+        if row is None or row.get(column) is None:
+            raise AssertionError("{}: file has no data rows".format(path))
+        return int_or_float(row[column])
+
+
+def rebase_chunk(
+    rows: List[List[str]],
+    ixs: List[int],
+    types: ColumnTypes,
+    amount: Number,
+    scale: Optional[float],
+) -> None:
+    for ix in ixs:
+        values = types.array(ix, [r[ix] for r in rows])
+        relative = values - amount
+        if scale is not None:
+            if relative.dtype.kind == "i":
+                relative = (relative * scale).round().astype(relative.dtype)
+            elif relative.dtype.kind == "f":
+                relative = relative * scale
+            else:
+                relative = [
+                    round(x * scale) if isinstance(x, int) else x * scale
+                    for x in relative
+                ]
+        for r, x in zip(rows, relative.tolist()):
+            r[ix] = x
+
+
+def rebase(
+    f: Any,
+    of: Any,
+    columns: List[str],
+    amount: Optional[Number],
+    scale: Optional[float],
+) -> None:
+    # comments are kept with the number of rows read before them
+    comments: Deque[Tuple[int, str]] = deque()
+    read = 0
+
+    def counted():
+        nonlocal read
+        for row in reader:
+            read += 1
+            yield row
+
+    reader = CommentedReader(f, on_comment=lambda x: comments.append((read, x)))
+    if reader.fieldnames is None:
         raise AssertionError("File has no fieldnames")
-    if not data:
+    ixs = [reader.index(c) for c in columns if c in reader.fieldnames]
+    width = max(ixs, default=-1) + 1
+    types = reader.infer_types()
+    data = counted()
+    chunk = list(islice(data, CHUNK_ROWS))
+    if not chunk:
         raise AssertionError("File has no data rows")
-    return csv.reader(meta), csv.DictReader(data, next(iter(csv.reader(fieldnames))))
+    if amount is None and ixs:
+        amount = types.numeric(ixs[0])(chunk[0][ixs[0]])
+    meta_writer = csv.writer(of)
+    meta_writer.writerows(reader.meta)
+    writer = csv.writer(of)
+    writer.writerow(reader.fieldnames)
+    written = 0
+    while chunk:
+        for ix, r in enumerate(chunk, start=written + 1):
+            if len(r) < width:
+                raise AssertionError(
+                    "Row {} has {} fields, expected {}".format(ix, len(r), width)
+                )
+        if ixs:
+            rebase_chunk(chunk, ixs, types, amount, scale)
+        # comments met while reading a row go out right before it
+        start = 0
+        while comments and comments[0][0] < written + len(chunk):
+            cut = comments[0][0] - written
+            writer.writerows(chunk[start:cut])
+            meta_writer.writerow(parse_line(comments.popleft()[1]))
+            start = cut
+        writer.writerows(chunk[start:])
+        written += len(chunk)
+        chunk = list(islice(data, CHUNK_ROWS))
+    meta_writer.writerows(parse_line(x) for _, x in comments)
 
 
-def main():
-    def filter_row(row: Dict, amount: Union[int, float], column: str):
-        return (
-            (k, v if k != column else int_or_float(v) - amount) for k, v in row.items()
+def convert_file(
+    path: Optional[str], output: Optional[str], args: argparse.Namespace
+) -> None:
+    amount = args.amount
+    if args.reference is not None:
+        amount = reference_amount(
+            reference_path(args.reference, path), args.reference_column
         )
+    # the first value stays the origin: relative times grow by the drift
+    scale = 1 + args.drift * 1e-6 if args.drift else None
+    with read_from(path) as f:
+        with output_to(output) as of:
+            rebase(f, of, args.column, amount, scale)
+
 
+def suffixed(path: str, suffix: str) -> str:
+    root, ext = os.path.splitext(path)
+    return root + suffix + ext
+
+
+def main():
     parser = argparse.ArgumentParser(
         description="Transform time values from absolute to relative"
     )
     args = add_arguments(parser).parse_args()
-    with read_from(args.source_file) as f:
-        meta, data = read_input_file(f)
-        with output_to(args.output) as of:
-            csv.writer(of).writerows(meta)
-            writer = csv.DictWriter(of, data.fieldnames)
-            writer.writeheader()
-            first_row = next(iter(data), None)
-            if first_row is not None:
-                if args.amount is None and args.column in first_row:
-                    args.amount = int_or_float(first_row[args.column])
-                writer.writerow(dict(filter_row(first_row, args.amount, args.column)))
-                for row in data:
-                    writer.writerow(dict(filter_row(row, args.amount, args.column)))
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be >= 1")
+    if args.amount is not None and args.reference is not None:
+        parser.error("-a/--amount and -r/--reference are mutually exclusive")
+    if args.output and len(args.source_files) > 1:
+        parser.error("-o/--output takes a single file, several use --suffix")
+    if not args.suffix and len(args.source_files) > 1:
+        parser.error("--suffix must not be empty, files would be overwritten")
+    args.column = list(dict.fromkeys(args.column or ["time"]))
+    paths = args.source_files or [None]
+    if len(paths) == 1:
+        convert_file(paths[0], args.output, args)
+        return
+    outputs = [suffixed(p, args.suffix) for p in paths]
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        list(executor.map(functools.partial(convert_file, args=args), paths, outputs))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+"""Single-pass statistics in constant memory.
+
+RunningStats keeps Welford's running mean and sum of squared deviations,
+P2Quantile keeps the first EXACT_SAMPLES values for an exact quantile,
+then estimates it with the P-square algorithm (Jain and Chlamtac, 1985)
+from five markers, and RunningCovariance keeps the co-moments needed for
+a least squares line and Pearson's r. Only the exact mode needs memory
+that grows, with the number of distinct values.
+"""
+
+import math
+from typing import Dict, List, Sequence, Tuple, Union
+
+Number = Union[int, float]
+
+EXACT_SAMPLES = 256
+
+
+def parse_percentiles(x: str) -> List[float]:
+    values = []
+    for item in x.split(","):
+        value = float(item.strip().lstrip("pP"))
+        if not 0 <= value <= 100:
+            raise ValueError("percentile must be within [0, 100]: {}".format(item))
+        values.append(value)
+    return values
+
+
+def percentile_label(p: float) -> str:
+    return "p{:g}".format(p)
+
+
+def percentile(values: Sequence[Number], p: float) -> float:
+    # linear interpolation between closest ranks, as numpy.percentile
+    ordered = sorted(values)
+    if not ordered:
+        raise ValueError("percentile requires at least one data point")
+    rank = (len(ordered) - 1) * p / 100
+    lo = math.floor(rank)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+class P2Quantile:
+    __slots__ = ("p", "buffer", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p: float) -> None:
+        self.p = p
+        # the first values are kept, and their quantile is exact, until
+        # there are enough to place the five markers
+        self.buffer: List[Number] = []
+        self.heights: List[float] = []
+        self.positions: List[int] = []
+        self.desired: List[float] = []
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def _start(self) -> None:
+        ordered = sorted(self.buffer)
+        count = len(ordered)
+        self.desired = [1 + (count - 1) * f for f in self.increments]
+        n = self.positions
+        for i, d in enumerate(self.desired):
+            # markers stay on distinct positions, even for p close to 0 or 1
+            low = n[-1] + 1 if n else 1
+            n.append(max(low, min(int(round(d)), count - 4 + i)))
+        self.heights = [ordered[x - 1] for x in n]
+        self.buffer = []
+
+    def add(self, x: Number) -> None:
+        if not self.heights:
+            self.buffer.append(x)
+            if len(self.buffer) >= EXACT_SAMPLES:
+                self._start()
+            return
+        q = self.heights
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = height
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self) -> float:
+        if not self.heights:
+            if not self.buffer:
+                raise ValueError("quantile requires at least one data point")
+            return percentile(self.buffer, self.p * 100)
+        # the outer markers are the exact minimum and maximum
+        if self.p == 0:
+            return self.heights[0]
+        if self.p == 1:
+            return self.heights[4]
+        return self.heights[2]
+
+
+class RunningStats:
+    __slots__ = ("count", "mean", "m2", "counts", "quantiles")
+
+    def __init__(self, percentiles: Sequence[float] = (50,)) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.counts: Dict[Number, int] = {}
+        self.quantiles = {p: P2Quantile(p / 100) for p in percentiles}
+
+    def add(self, x: Number) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.counts[x] = self.counts.get(x, 0) + 1
+        for q in self.quantiles.values():
+            q.add(x)
+
+    @property
+    def variance(self) -> float:
+        if self.count < 2:
+            raise ValueError("variance requires at least two data points")
+        return self.m2 / (self.count - 1)
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self.variance)
+
+    @property
+    def mode(self) -> Number:
+        if not self.counts:
+            raise ValueError("mode requires at least one data point")
+        # first value reaching the highest count, as statistics.mode
+        return max(self.counts, key=self.counts.__getitem__)
+
+    def percentile(self, p: float) -> float:
+        return self.quantiles[p].value
+
+
+class RunningCovariance:
+    __slots__ = ("count", "mean_x", "mean_y", "cxx", "cyy", "cxy")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean_x = self.mean_y = 0.0
+        self.cxx = self.cyy = self.cxy = 0.0
+
+    def add(self, x: Number, y: Number) -> None:
+        self.count += 1
+        dx = x - self.mean_x
+        self.mean_x += dx / self.count
+        dy = y - self.mean_y
+        self.mean_y += dy / self.count
+        self.cxx += dx * (x - self.mean_x)
+        self.cyy += dy * (y - self.mean_y)
+        self.cxy += dx * (y - self.mean_y)
+
+    def linear_regression(self) -> Tuple[float, float]:
+        # y = m * x + c by least squares
+        if not self.cxx:
+            raise ValueError("x values must not be constant")
+        m = self.cxy / self.cxx
+        return m, self.mean_y - m * self.mean_x
+
+    def correlation(self) -> float:
+        denom = math.sqrt(self.cxx * self.cyy)
+        return self.cxy / denom if denom else math.nan